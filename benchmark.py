@@ -0,0 +1,278 @@
+"""Synthetic-data benchmarks for the geometry, binning, integration and frame-access hot paths.
+
+Everything is generated locally in WORK_DIR: Eiger-sized frames with a weak
+Poisson background and a few bright spots, a PONI geometry and a multi-frame
+HDF5 series. Each benchmark is timed (best of REPEATS) at several detector
+sizes, the frame-access ones also at several series lengths, with peak memory
+measured through ``tracemalloc``. A benchmark that raises is recorded with its
+error and the run continues. Results are written to JSON after every size;
+comparing against a baseline flags every benchmark whose time or peak memory
+grew by more than THRESHOLD.
+
+Usage:
+    python benchmark.py                       # run, write benchmark.json
+    python benchmark.py --save-baseline       # run, write benchmark_baseline.json
+    python benchmark.py --compare             # run, compare with the baseline
+    python benchmark.py --sizes 1M --series 50
+    python benchmark.py --check               # parity of the block/sparse binning with qrebin
+"""
+
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import h5py
+import numpy as np
+import pyFAI
+
+sys.path.append(str(Path(__file__).resolve().parent / "extract_peak"))
+from iq import integrate_iq
+from model import ImageSeriesModel
+from utils.cake import CakeEngine
+from utils.frames import SparseSeries, convert_series
+from utils.pixels import PixelIndex
+from utils.rot import det2q, det2q_pixels, qrebin, qsize, qtransform, qtransform_sparse, qtransform_valid
+from utils.stats import PixelStats, reduce_frames
+
+# Constants
+WORK_DIR = "benchmark_data"
+RESULT_FILE = "benchmark.json"
+BASELINE_FILE = "benchmark_baseline.json"
+THRESHOLD = 0.2  # flag benchmarks more than 20 % slower (or larger) than the baseline
+REPEATS = 3
+SIZES = {  # detector shapes (rows, cols), Eiger2 1M / 4M / 16M
+    "1M": (1065, 1030),
+    "4M": (2162, 2068),
+    "16M": (4371, 4150),
+}
+SERIES = {  # frames per synthetic series, for the frame-access benchmarks
+    "50": 50,
+    "500": 500,
+}
+DQ = 1e-3  # unit (1/A)
+MEMORY_MB = 256
+# Parity check: small enough voxels for several q3 bins, small enough budget for many blocks
+CHECK_SIZE = "1M"
+CHECK_DQ = 1e-4  # unit (1/A)
+CHECK_MEMORY_MB = 8
+
+work_path = Path(WORK_DIR).resolve()
+
+
+# === Synthetic data ===
+def synthetic_poni(shape) -> Path:
+    """PONI file for a 75 µm pixel detector at 5 m, beam near the centre."""
+    path = work_path / f"calib_{shape[0]}x{shape[1]}.poni"
+    path.write_text(
+        "poni_version: 2\n"
+        "Detector: Detector\n"
+        f'Detector_config: {{"pixel1": 7.5e-05, "pixel2": 7.5e-05, "max_shape": [{shape[0]}, {shape[1]}]}}\n'
+        "Distance: 5.0\n"
+        f"Poni1: {shape[0] * 0.52 * 7.5e-05}\n"
+        f"Poni2: {shape[1] * 0.48 * 7.5e-05}\n"
+        "Rot1: 0.001\nRot2: -0.002\nRot3: 0.0\n"
+        "Wavelength: 1e-10\n"
+    )
+    return path
+
+
+def synthetic_mask(shape) -> np.ndarray:
+    """Periodic module-gap lines and a beamstop shadow around the PONI."""
+    mask = np.zeros(shape, dtype=bool)
+    mask[514::551, :] = True
+    mask[:, 1030::1040] = True
+    r0, c0 = int(shape[0] * 0.52), int(shape[1] * 0.48)
+    mask[r0 - 20 : r0 + 20, c0 - 20 : c0 + 20] = True
+    return mask
+
+
+def synthetic_frame(shape, rng, n_spots=20) -> np.ndarray:
+    img = rng.poisson(0.05, size=shape).astype(np.uint32)
+    rows = rng.integers(0, shape[0] - 3, n_spots)
+    cols = rng.integers(0, shape[1] - 3, n_spots)
+    for r, c in zip(rows, cols):
+        img[r : r + 3, c : c + 3] += rng.integers(100, 5000, dtype=np.uint32)
+    return img
+
+
+def synthetic_series(shape, n_frames, rng) -> Path:
+    """Eiger-style master file with one (n_frames, rows, cols) data block."""
+    path = work_path / f"series_{shape[0]}x{shape[1]}_{n_frames}_master.h5"
+    if not path.exists():
+        with h5py.File(path, "w") as f:
+            data = f.create_dataset(
+                "entry/data/data_000001", shape=(n_frames,) + shape, dtype=np.uint32, chunks=(1,) + shape, compression="lzf"
+            )
+            for i in range(n_frames):
+                data[i] = synthetic_frame(shape, rng)
+    return path
+
+
+# === Measurement ===
+def measure(func, n_items: float, unit: str) -> dict:
+    """Best-of-REPEATS wall time, throughput and peak traced memory of *func()*."""
+    seconds = []
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    best = min(seconds)
+    return {"seconds": best, "throughput": n_items / best, "unit": unit, "peak_mb": peak / 2**20}
+
+
+def run_size(name: str, shape, series: dict[str, int]) -> dict[str, dict]:
+    rng = np.random.default_rng(0)
+    ai = pyFAI.load(str(synthetic_poni(shape)))
+    mask = synthetic_mask(shape)
+    pixels = PixelIndex(mask)
+    img = synthetic_frame(shape, rng)
+    n_pixels = shape[0] * shape[1]
+    results: dict[str, dict] = {}
+
+    def record(bench, func, n_items, unit, label=name):
+        key = f"{bench}[{label}]"
+        try:
+            results[key] = measure(func, n_items, unit)
+        except Exception as e:
+            results[key] = {"error": repr(e)}
+            print(f"{key:<32} failed: {e!r}")
+            return
+        print(f"{key:<32} {results[key]['seconds']:>9.3f} s {results[key]['throughput']:>12.3e} {unit} "
+              f"{results[key]['peak_mb']:>9.1f} MB")
+
+    # Geometry
+    d1, d2 = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), indexing='ij')
+    record("det2q", lambda: det2q(np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), 0, indexing='ij'), ai),
+           n_pixels, "px/s")
+    record("det2q_pixels_f32", lambda: det2q_pixels(d1, d2, ai, 0, np.float32), n_pixels, "px/s")
+
+    # Binning
+    record("qtransform_tiled", lambda: qtransform(img, ai, DQ, memory_mb=MEMORY_MB), n_pixels, "px/s")
+    record("qtransform_tiled_f32", lambda: qtransform(img, ai, DQ, memory_mb=MEMORY_MB, dtype=np.float32),
+           n_pixels, "px/s")
+    # q of the valid pixels is recomputed on every call, the cached variant keeps it in its own PixelIndex
+    record("qtransform_valid", lambda: qtransform(img, ai, DQ, memory_mb=MEMORY_MB, pixels=pixels), n_pixels, "px/s")
+    cached = PixelIndex(mask)
+    record("qtransform_valid_cached", lambda: qtransform_valid(img, ai, DQ, cached, MEMORY_MB, cache=True),
+           n_pixels, "px/s")
+    record("qtransform_sparse", lambda: qtransform_sparse(img, ai, DQ, memory_mb=MEMORY_MB), n_pixels, "px/s")
+    if name == "1M":  # one-shot path holds several full-detector object arrays
+        record("qtransform", lambda: qtransform(img, ai, DQ), n_pixels, "px/s")
+
+    # Integration
+    stats = PixelStats(shape)
+    for _ in range(3):
+        stats.update(synthetic_frame(shape, rng))
+    record("integrate_iq", lambda: integrate_iq(stats, ai, mask, "q_A^-1", 100, ["avg_direct", "var_direct"]),
+           2 * n_pixels, "px/s")
+    engine = CakeEngine(ai, pixels)
+    frames = np.stack([img] * 4)
+    record("cake_engine", lambda: engine.integrate(frames), 4, "frames/s")
+
+    # Frame access, per series length
+    for length, n_frames in series.items():
+        label = f"{name},{length}"
+        series_path = synthetic_series(shape, n_frames, rng)
+        model = ImageSeriesModel(series_path, work_path / "peaks.dill")
+
+        def walk_frames():
+            for i in range(n_frames):
+                model.set_current_frame(i)
+                model.extract_peak(shape[1] // 2, shape[0] // 2)
+
+        record("current_image+extract_peak", walk_frames, n_frames, "frames/s", label)
+        record("reduce_frames", lambda: reduce_frames(series_path, 0, n_frames), n_frames, "frames/s", label)
+
+        sparse_path = work_path / f"series_{shape[0]}x{shape[1]}_{n_frames}.sparse.h5"
+        convert_series(series_path, sparse_path, threshold=0, mask=mask)
+        sparse = SparseSeries(sparse_path)
+        record("sparse_read", lambda: [sparse.get_frame(i).data for i in range(n_frames)], n_frames, "frames/s", label)
+        sparse.close()
+
+    return results
+
+
+# === Parity ===
+def parity(name: str, result: np.ndarray, reference: np.ndarray) -> bool:
+    """Print and return whether *result* reproduces every bin of *reference*."""
+    if result.shape != reference.shape:
+        print(f"{name:<32} shape {result.shape} != {reference.shape}")
+        return False
+    mismatched = int(np.count_nonzero(~np.isclose(result, reference, rtol=1e-9, atol=0)))
+    print(f"{name:<32} {mismatched:>9d} of {np.count_nonzero(reference)} non-empty bins differ")
+    return mismatched == 0
+
+
+def check_parity(shape) -> list[str]:
+    """Names of the binning paths that do not reproduce the one-shot ``qrebin`` on a synthetic frame."""
+    rng = np.random.default_rng(0)
+    ai = pyFAI.load(str(synthetic_poni(shape)))
+    img = synthetic_frame(shape, rng)
+    points = np.meshgrid(np.arange(shape[0]), np.arange(shape[1]), 0, indexing='ij')
+    qpoints = tuple(np.asarray(q, dtype=np.float64) for q in det2q(points, ai))
+    failures = []
+
+    # Row blocks, against qrebin over the full detector extent
+    qrange, nq = qsize(qpoints, ai, CHECK_DQ)
+    if not parity("qtransform_tiled", qtransform(img, ai, CHECK_DQ, memory_mb=CHECK_MEMORY_MB),
+                  qrebin(qpoints, qrange, nq, img)):
+        failures.append("qtransform_tiled")
+
+    # Sparse grid, against qrebin on the same voxel edges
+    volume, edges = qtransform_sparse(img, ai, CHECK_DQ, memory_mb=CHECK_MEMORY_MB).to_dense()
+    reference = qrebin(qpoints, tuple((e[0], e[-1]) for e in edges), volume.shape, img)
+    if not parity("qtransform_sparse", volume, reference):
+        failures.append("qtransform_sparse")
+
+    return failures
+
+
+def compare(results: dict[str, dict], baseline: dict[str, dict]) -> list[str]:
+    """Names of the benchmarks slower or larger than the baseline by more than THRESHOLD."""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline or "error" in result or "error" in baseline[key]:
+            continue
+        ratio = result["seconds"] / baseline[key]["seconds"]
+        mem_ratio = result["peak_mb"] / max(baseline[key]["peak_mb"], 1e-3)
+        flags = [label for label, r in (("TIME", ratio), ("MEMORY", mem_ratio)) if r > 1 + THRESHOLD]
+        print(f"{key:<32} {ratio:>7.2f}x {mem_ratio:>7.2f}x mem {' '.join(flags)}")
+        if flags:
+            regressions.append(key)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--series", nargs="+", default=list(SERIES), choices=list(SERIES))
+    parser.add_argument("--save-baseline", action="store_true", help=f"write results to {BASELINE_FILE}")
+    parser.add_argument("--compare", action="store_true", help=f"compare with {BASELINE_FILE}")
+    parser.add_argument("--check", action="store_true", help=f"only check binning parity at {CHECK_SIZE}")
+    args = parser.parse_args()
+
+    work_path.mkdir(parents=True, exist_ok=True)
+    if args.check:
+        failures = check_parity(SIZES[CHECK_SIZE])
+        if failures:
+            print(f"{len(failures)} binning path(s) differ from qrebin: {', '.join(failures)}")
+        sys.exit(1 if failures else 0)
+
+    result_path = Path(BASELINE_FILE if args.save_baseline else RESULT_FILE)
+    results: dict[str, dict] = {}
+    for size in args.sizes:
+        results.update(run_size(size, SIZES[size], {length: SERIES[length] for length in args.series}))
+        result_path.write_text(json.dumps(results, indent=2))  # keep what finished if a later size dies
+
+    if args.compare:
+        regressions = compare(results, json.loads(Path(BASELINE_FILE).read_text()))
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond {THRESHOLD:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
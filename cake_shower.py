@@ -0,0 +1,26 @@
+from pathlib import Path
+import pyFAI
+from utils.cake import CakeEngine, cake_series
+from utils.pixels import PixelIndex
+
+# Constants
+INPUT_DIR = "shower_cubic_normal_5"
+CALIB_DIR = "agbh_jun_2024"
+OUTPUT_DIR = "shower_cubic_normal_5"
+FILE_NAME = "Diamond_shower_normal_SiO2_5_master.h5"
+WORKERS = None  # processes, None = all cores
+
+input_path = Path(INPUT_DIR).resolve() / FILE_NAME
+calib_path = Path(CALIB_DIR).resolve() / "calib.poni"
+mask_path = Path(CALIB_DIR).resolve() / "mask.edf"
+output_path = Path(OUTPUT_DIR).resolve() / "cake.npy"
+
+if __name__ == "__main__":
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Build the integration matrix once, then cake every frame into the cube
+    ai = pyFAI.load(str(calib_path))
+    pixels = PixelIndex.from_file(mask_path)
+    engine = CakeEngine(ai, pixels, 200, 180, unit='q_A^-1', radial_range=(0, 0.025))
+    cube = cake_series(input_path, output_path, engine, workers=WORKERS)
+    print(cube.shape)
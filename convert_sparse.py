@@ -0,0 +1,19 @@
+import fabio
+from pathlib import Path
+from utils.frames import SPARSE_SUFFIX, convert_series
+
+# Constants
+INPUT_DIR = "shower_cubic_normal_5"
+CALIB_DIR = "agbh_jun_2024"
+OUTPUT_DIR = "shower_cubic_normal_5"
+FILE_NAME = "Diamond_shower_normal_SiO2_5_master.h5"
+THRESHOLD = 0
+
+input_path = Path(INPUT_DIR).resolve() / FILE_NAME
+mask_path = Path(CALIB_DIR).resolve() / "mask.edf"
+output_path = Path(OUTPUT_DIR).resolve() / (Path(FILE_NAME).stem + SPARSE_SUFFIX)
+output_path.parent.mkdir(parents=True, exist_ok=True)
+
+# Convert the raw series, keeping only unmasked pixels above the threshold
+mask = fabio.open(mask_path).data.astype(bool)
+convert_series(input_path, output_path, threshold=THRESHOLD, mask=mask)
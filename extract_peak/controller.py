@@ -12,6 +12,7 @@ from PyQt5.QtWidgets import QApplication
 
 from model import ImageSeriesModel
 from view import Viewer
+from utils.trace import span
 
 __all__ = ["ViewerController", "run_app"]
 
@@ -82,13 +83,14 @@ class ViewerController:  # noqa: D401 – orchestrator class
         return self._view
 
     def _refresh_view(self, *, full: bool = True):
-        img = self._model.current_image()
-        self._view.set_image(img)
-        coords: list[tuple[int, int]] = [p.coordinate for p in self._model.peaks_for_current_frame()]
-        self._view.set_markers(coords)
-        self._view.set_info(self._model.frame_current, self._model.total_peak_count())
-        if full:
-            self._view.set_slider_position(self._model.frame_current)
+        with span("refresh_view"):
+            img = self._model.current_image()
+            self._view.set_image(img)
+            coords: list[tuple[int, int]] = [p.coordinate for p in self._model.peaks_for_current_frame()]
+            self._view.set_markers(coords)
+            self._view.set_info(self._model.frame_current, self._model.total_peak_count())
+            if full:
+                self._view.set_slider_position(self._model.frame_current)
 
 
 def run_app(file_data: Path, file_result: Path, xrange: list[int], yrange: list[int], vmin: int = 0, vmax: int = 500):
@@ -6,12 +6,16 @@ manages domain data and business logic.
 """
 
 import dill
+import sys
 from collections import defaultdict
 from pathlib import Path
 
-import fabio
 import numpy as np
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repository root, for *utils*
+from utils.frames import open_frames, sanitize
+from utils.trace import span
+
 __all__ = [
     "Peak",
     "ImageSeriesModel",
@@ -59,8 +63,9 @@ class ImageSeriesModel:
         self._file_data: Path = file_data
         self._file_result: Path = file_result
 
-        # Fabio can open a multi-frame series through the first file name
-        self._img_series = fabio.open_series(first_filename=str(self._file_data))
+        # Fabio can open a multi-frame series through the first file name,
+        # ``*.sparse.h5`` files are read through the sparse per-frame reader
+        self._img_series = open_frames(self._file_data)
 
         # Initial state values
         self.frame_first: int = 0
@@ -86,15 +91,13 @@ class ImageSeriesModel:
     #Public Methods - Image Processing
     def current_image(self) -> np.ndarray:
         """Return a *sanitised* image for *frame_current* as ``np.ndarray``."""
-        frame_data = self._img_series.get_frame(self.frame_current).data
+        with span("frame decode"):
+            frame_data = self._img_series.get_frame(self.frame_current).data
         if frame_data is None:
             raise ValueError("Frame data is None")
-        img = frame_data.astype(np.int32)
         # Basic clean-up (domain-specific)
-        img = img.copy()
-        img[img > 10000] = 0
-        img[img < 0] = 0
-        return img
+        with span("sanitize"):
+            return sanitize(frame_data)
 
     def extract_peak(self, x: int, y: int, size: int = 9) -> np.ndarray:
         """Return a *size × size* excerpt around *(x, y)* from *current_image*."""
@@ -7,6 +7,9 @@ appropriately. The widget itself knows NOTHING about how to handle data – it
 just forwards events and waits for methods to be called to update its visuals.
 """
 
+import sys
+from pathlib import Path
+
 import numpy as np
 from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtWidgets import (
@@ -30,6 +33,9 @@ import matplotlib.pyplot as plt
 
 matplotlib.use("Qt5Agg", force=True)  # Ensure Qt5 backend is active
 
+sys.path.append(str(Path(__file__).resolve().parents[1]))  # repository root, for *utils*
+from utils.trace import span
+
 __all__ = ["Viewer"]
 
 
@@ -155,13 +161,15 @@ class Viewer(QWidget):  # noqa: D401 – widget class
     def _update_axis_limits(self):
         self._ax.set_xlim(self._xrange)
         self._ax.set_ylim(self._yrange)
-        self._canvas.draw()
+        with span("canvas.draw"):
+            self._canvas.draw()
 
     #Public Methods
     def set_image(self, img: np.ndarray) -> None:
         self._im.set_data(img)
         self._im.set_extent((0, img.shape[1], img.shape[0], 0))
-        self._canvas.draw()
+        with span("canvas.draw"):
+            self._canvas.draw()
 
     def set_markers(self, coordinates: list[tuple[int, int]]):
         # Remove old markers first
@@ -171,7 +179,8 @@ class Viewer(QWidget):  # noqa: D401 – widget class
         for x, y in coordinates:
             (marker,) = self._ax.plot(x, y, "x", markersize=10, color="white")
             self._markers.append(marker)
-        self._canvas.draw()
+        with span("canvas.draw"):
+            self._canvas.draw()
 
     def set_info(self, frame_idx: int, peak_count: int) -> None:
         self._frame_label.setText(f"Frame: {frame_idx}")
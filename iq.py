@@ -1,9 +1,17 @@
+import hashlib
+import json
 from pathlib import Path
+from typing import TYPE_CHECKING
 import numpy as np
 import pyFAI
 import fabio
-from saxs_decosmic.core.series_processor import SeriesResult
 import pandas as pd
+from utils.frames import SANITIZE_MAX, SANITIZE_MIN
+from utils.stats import PixelStats, series_stats
+from utils.trace import span
+
+if TYPE_CHECKING:
+    from saxs_decosmic.core.series_processor import SeriesResult
 
 # === Constants ===
 INPUT_DIR = "."
@@ -16,34 +24,69 @@ VARIANTS = [
     "var_direct", "var_half_clean", "var_clean",
     "avg_donut", "avg_streak"
 ]
+# "processed" loads saxs_decosmic results, "raw" reduces <measurement>/RAW_FILE_NAME directly
+SOURCE = "processed"
+RAW_FILE_NAME = "master.h5"
+RAW_VARIANTS = ["avg_direct", "var_direct"]
+WORKERS = None  # processes for the raw reduction, None = all cores
+# Bulk mode: every measurement in SAMPLES minus the shared REFERENCES (each integrated once and cached)
+BULK = False
+SAMPLES: list[str] = []
+REFERENCES = {"water": 1.0}  # reference measurement -> default scale factor
+SCALES_FILE = None  # optional CSV, one row per sample, one scale column per reference
 
-input_path = Path(INPUT_DIR).resolve()
-output_path = Path(OUTPUT_DIR).resolve()
-output_path.mkdir(parents=True, exist_ok=True)
+# === Data Loading ===
+def stats_source(raw_path: Path) -> str:
+    """Provenance of raw statistics: the series file as reduced and the sanitising bounds."""
+    stat = raw_path.stat()
+    return json.dumps({
+        "path": str(raw_path.resolve()),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sanitize": [SANITIZE_MIN, SANITIZE_MAX],
+    }, sort_keys=True)
 
-# === Mask and Calibration ===
-mask = fabio.open(input_path / "mask.edf").data.astype(bool)
-calib = input_path / "calib.poni"
-ai = pyFAI.load(str(calib))
+def load_measurement(input_path: Path, measurement: str) -> "SeriesResult | PixelStats":
+    """Load the per-pixel images of a measurement from the configured source.
 
-# === Data Loading ===
-processed_results: dict[str, SeriesResult] = {}
-for measurement in MEASUREMENTS:
-    processed_results[measurement] = SeriesResult()
-    processed_results[measurement].load(str(input_path / measurement / "processed"), measurement)
+    Raw statistics are cached in ``<measurement>/stats.npz`` and reused only
+    while the series file and sanitising bounds they were reduced from are
+    unchanged.
+    """
+    if SOURCE == "raw":
+        raw_path = input_path / measurement / RAW_FILE_NAME
+        stats_path = input_path / measurement / "stats.npz"
+        source = stats_source(raw_path)
+        if stats_path.exists():
+            with np.load(stats_path) as cached:
+                fresh = "source" in cached.files and str(cached["source"]) == source
+            if fresh:
+                return PixelStats.load(stats_path)
+        stats = series_stats(raw_path, workers=WORKERS)
+        stats.save(stats_path, source=np.array(source))
+        return stats
+    # saxs_decosmic is only needed for processed results, raw mode and the benchmarks run without it
+    from saxs_decosmic.core.series_processor import SeriesResult
+
+    result = SeriesResult()
+    result.load(str(input_path / measurement / "processed"), measurement)
+    return result
 
 # === I(q) Integration ===
 def integrate_iq(
-    processed_result: SeriesResult,
+    processed_result: "SeriesResult | PixelStats",
+    ai,
     mask: np.ndarray,
     unit: str,
-    n_points: int
+    n_points: int,
+    variants: list[str] = VARIANTS,
 ) -> dict[str, pd.DataFrame]:
     """Integrate I(q) for each variant of a measurement."""
     iq_result: dict[str, pd.DataFrame] = {}
-    for variant in VARIANTS:
+    for variant in variants:
         image = getattr(processed_result, variant)
-        q, intensity, sigma = ai.integrate1d(image, n_points, mask=mask, unit=unit, error_model="azimuthal")
+        with span("pyFAI integrate1d"):
+            q, intensity, sigma = ai.integrate1d(image, n_points, mask=mask, unit=unit, error_model="azimuthal")
         iq_result[variant] = pd.DataFrame({
             'q': q,
             'intensity': intensity,
@@ -51,34 +94,206 @@ def integrate_iq(
         })
     return iq_result
 
-# Integrate for all measurements
-iq_results: dict[str, dict[str, pd.DataFrame]] = {}
-for measurement in MEASUREMENTS:
-    iq_results[measurement] = integrate_iq(processed_results[measurement], mask, UNIT, BINNING)
-
-# Calculate subtracted (final) I(q)
-final_iq_result: dict[str, pd.DataFrame] = {}
-for variant in VARIANTS:
-    final_q = iq_results[MEASUREMENTS[0]][variant]['q']
-    final_intensity = iq_results[MEASUREMENTS[0]][variant]['intensity'] - iq_results[MEASUREMENTS[1]][variant]['intensity']
-    final_sigma = np.sqrt(
-        iq_results[MEASUREMENTS[0]][variant]['sigma']**2 +
-        iq_results[MEASUREMENTS[1]][variant]['sigma']**2
-    )
-    # Only keep positive intensities for non-background variants
-    if 'donut' not in variant and 'streak' not in variant:
-        final_mask = final_intensity > 0
-        final_q = final_q[final_mask]
-        final_intensity = final_intensity[final_mask]
-        final_sigma = final_sigma[final_mask]
-    final_iq_result[variant] = pd.DataFrame({
-        'q': final_q,
-        'intensity': final_intensity,
-        'sigma': final_sigma,
-    })
-
-# === Output ===
-for variant in VARIANTS:
+
+def subtract_iq(iq_results: dict[str, dict[str, pd.DataFrame]], variants: list[str] = VARIANTS) -> dict[str, pd.DataFrame]:
+    """Subtract MEASUREMENTS[1] from MEASUREMENTS[0] for each variant."""
+    final_iq_result: dict[str, pd.DataFrame] = {}
+    for variant in variants:
+        final_q = iq_results[MEASUREMENTS[0]][variant]['q']
+        final_intensity = iq_results[MEASUREMENTS[0]][variant]['intensity'] - iq_results[MEASUREMENTS[1]][variant]['intensity']
+        final_sigma = np.sqrt(
+            iq_results[MEASUREMENTS[0]][variant]['sigma']**2 +
+            iq_results[MEASUREMENTS[1]][variant]['sigma']**2
+        )
+        # Only keep positive intensities for non-background variants
+        if 'donut' not in variant and 'streak' not in variant:
+            final_mask = final_intensity > 0
+            final_q = final_q[final_mask]
+            final_intensity = final_intensity[final_mask]
+            final_sigma = final_sigma[final_mask]
+        final_iq_result[variant] = pd.DataFrame({
+            'q': final_q,
+            'intensity': final_intensity,
+            'sigma': final_sigma,
+        })
+    return final_iq_result
+
+def run_iq(input_path: Path, output_path: Path, ai, mask: np.ndarray) -> None:
+    """Load, integrate and subtract all measurements, then write the CSV files."""
+    output_path.mkdir(parents=True, exist_ok=True)
+    variants = RAW_VARIANTS if SOURCE == "raw" else VARIANTS
+
+    processed_results: dict[str, "SeriesResult | PixelStats"] = {}
     for measurement in MEASUREMENTS:
-        iq_results[measurement][variant].to_csv(output_path / f"{measurement}_{variant}.csv", index=False)
-    final_iq_result[variant].to_csv(output_path / f"final_{variant}.csv", index=False)
+        processed_results[measurement] = load_measurement(input_path, measurement)
+
+    # Integrate for all measurements
+    iq_results: dict[str, dict[str, pd.DataFrame]] = {}
+    for measurement in MEASUREMENTS:
+        iq_results[measurement] = integrate_iq(processed_results[measurement], ai, mask, UNIT, BINNING, variants)
+
+    # Calculate subtracted (final) I(q)
+    final_iq_result = subtract_iq(iq_results, variants)
+
+    # === Output ===
+    for variant in variants:
+        for measurement in MEASUREMENTS:
+            iq_results[measurement][variant].to_csv(output_path / f"{measurement}_{variant}.csv", index=False)
+        final_iq_result[variant].to_csv(output_path / f"final_{variant}.csv", index=False)
+
+
+# === Bulk subtraction ===
+def stack_iq(iq_result: dict[str, pd.DataFrame], variants: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return q (n_q,) and intensity, sigma (n_variants, n_q) of one measurement."""
+    q = iq_result[variants[0]]['q'].to_numpy()
+    intensity = np.stack([iq_result[variant]['intensity'].to_numpy() for variant in variants])
+    sigma = np.stack([iq_result[variant]['sigma'].to_numpy() for variant in variants])
+    return q, intensity, sigma
+
+def source_files(input_path: Path, measurement: str) -> list[Path]:
+    """Files the configured source reads for a measurement."""
+    path = input_path / measurement / (RAW_FILE_NAME if SOURCE == "raw" else "processed")
+    if path.is_dir():
+        return sorted(p for p in path.rglob("*") if p.is_file())
+    return [path]
+
+def reference_fingerprint(input_path: Path, measurement: str, ai, mask: np.ndarray) -> str:
+    """Hash of everything a cached reference I(q) depends on: geometry, mask, binning and source files."""
+    files = [(str(p.relative_to(input_path)), p.stat().st_mtime_ns, p.stat().st_size)
+             for p in source_files(input_path, measurement) if p.exists()]
+    state = {
+        "poni": ai.get_config(),
+        "mask": hashlib.sha1(np.packbits(np.asarray(mask, dtype=bool))).hexdigest(),
+        "shape": list(np.shape(mask)),
+        "binning": BINNING,
+        "unit": UNIT,
+        "source": SOURCE,
+        "files": files,
+    }
+    return hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode()).hexdigest()
+
+def integrate_reference(
+    input_path: Path,
+    cache_path: Path,
+    measurement: str,
+    ai,
+    mask: np.ndarray,
+    variants: list[str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Stacked I(q) of a reference, integrated once and cached on disk for later runs.
+
+    The cache is reused only while its fingerprint (see ``reference_fingerprint``)
+    and variants match, otherwise the reference is integrated again.
+    """
+    cache_file = cache_path / f"{measurement}.npz"
+    fingerprint = reference_fingerprint(input_path, measurement, ai, mask)
+    if cache_file.exists():
+        with np.load(cache_file) as cached:
+            if (
+                "fingerprint" in cached.files and str(cached["fingerprint"]) == fingerprint
+                and list(cached["variants"]) == variants
+            ):
+                return cached["q"], cached["intensity"], cached["sigma"]
+    iq_result = integrate_iq(load_measurement(input_path, measurement), ai, mask, UNIT, BINNING, variants)
+    q, intensity, sigma = stack_iq(iq_result, variants)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_file, q=q, intensity=intensity, sigma=sigma, variants=np.array(variants),
+             fingerprint=np.array(fingerprint))
+    return q, intensity, sigma
+
+def subtract_bulk(
+    intensity: np.ndarray,
+    sigma: np.ndarray,
+    ref_intensity: np.ndarray,
+    ref_sigma: np.ndarray,
+    scales: np.ndarray,
+    variants: list[str],
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Subtract scaled references from all samples in one broadcasted pass.
+
+    *intensity*/*sigma* are (n_samples, n_variants, n_q), *ref_intensity*/
+    *ref_sigma* (n_references, n_variants, n_q) and *scales* (n_samples,
+    n_references). Returns the subtracted intensity, the propagated sigma and
+    the keep mask (positive intensities, except for background variants).
+    """
+    final_intensity = intensity - np.einsum('sr,rvq->svq', scales, ref_intensity)
+    final_sigma = np.sqrt(sigma**2 + np.einsum('sr,rvq->svq', scales**2, ref_sigma**2))
+    # Only keep positive intensities for non-background variants
+    positive = np.array(['donut' not in variant and 'streak' not in variant for variant in variants])
+    keep = (final_intensity > 0) | ~positive[None, :, None]
+    return final_intensity, final_sigma, keep
+
+def load_scales(samples: list[str], references: dict[str, float], scales_file: str | Path | None) -> np.ndarray:
+    """(n_samples, n_references) scale factors, from *scales_file* where given.
+
+    Every sample needs a row in *scales_file* (names compared as text); empty
+    cells and missing reference columns fall back to the default scale.
+    """
+    scales = np.tile(np.array(list(references.values()), dtype=np.float64), (len(samples), 1))
+    if scales_file is not None:
+        table = pd.read_csv(scales_file, dtype=str)
+        table = table.set_index(table.columns[0])
+        missing = [sample for sample in samples if sample not in table.index]
+        if missing:
+            raise ValueError(f"Samples missing from {scales_file}: {', '.join(missing)}")
+        table = table.reindex(index=samples, columns=list(references)).astype(np.float64)
+        scales = np.where(table.isna().to_numpy(), scales, table.to_numpy())
+    return scales
+
+def run_bulk(
+    input_path: Path,
+    output_path: Path,
+    ai,
+    mask: np.ndarray,
+    samples: list[str] = SAMPLES,
+    references: dict[str, float] = REFERENCES,
+    scales_file: str | Path | None = SCALES_FILE,
+) -> None:
+    """Reduce a whole plate: integrate every sample, subtract the shared references, write the results."""
+    output_path.mkdir(parents=True, exist_ok=True)
+    variants = RAW_VARIANTS if SOURCE == "raw" else VARIANTS
+
+    refs = [integrate_reference(input_path, output_path / "cache", ref, ai, mask, variants) for ref in references]
+    q = refs[0][0]
+    ref_intensity = np.stack([ref[1] for ref in refs])
+    ref_sigma = np.stack([ref[2] for ref in refs])
+
+    # Integrate the samples one at a time, only the stacked I(q) is kept
+    intensity = np.empty((len(samples), len(variants), q.size))
+    sigma = np.empty_like(intensity)
+    for i, sample in enumerate(samples):
+        iq_result = integrate_iq(load_measurement(input_path, sample), ai, mask, UNIT, BINNING, variants)
+        q_sample, intensity[i], sigma[i] = stack_iq(iq_result, variants)
+        if not np.allclose(q_sample, q):
+            raise ValueError(f"q-grid of {sample!r} differs from the references")
+
+    scales = load_scales(samples, references, scales_file)
+    final_intensity, final_sigma, keep = subtract_bulk(intensity, sigma, ref_intensity, ref_sigma, scales, variants)
+
+    # === Output ===
+    np.savez(
+        output_path / "final_bulk.npz", q=q, samples=np.array(samples), variants=np.array(variants),
+        intensity=final_intensity, sigma=final_sigma, keep=keep, scales=scales,
+    )
+    for i, sample in enumerate(samples):
+        for j, variant in enumerate(variants):
+            pd.DataFrame({
+                'q': q[keep[i, j]],
+                'intensity': final_intensity[i, j][keep[i, j]],
+                'sigma': final_sigma[i, j][keep[i, j]],
+            }).to_csv(output_path / f"final_{sample}_{variant}.csv", index=False)
+
+
+if __name__ == "__main__":
+    input_path = Path(INPUT_DIR).resolve()
+    output_path = Path(OUTPUT_DIR).resolve()
+
+    # === Mask and Calibration ===
+    mask = fabio.open(input_path / "mask.edf").data.astype(bool)
+    calib = input_path / "calib.poni"
+    ai = pyFAI.load(str(calib))
+
+    if BULK:
+        run_bulk(input_path, output_path, ai, mask)
+    else:
+        run_iq(input_path, output_path, ai, mask)
@@ -0,0 +1,179 @@
+"""Config-driven runner for the analysis scripts of one dataset.
+
+The stages of ``iq.py``, ``plot_powder.py``, ``plot_shower.py`` and
+``plot_peaks.py`` run in one process as a dependency graph. Calibrations,
+masks and frames are loaded once through :class:`Resources` and shared by all
+stages; stages whose dependencies are met run concurrently in a thread pool.
+Loading and integration overlap, figure construction and saving are
+serialised through ``plot_style.FIGURE_LOCK`` (Matplotlib is not thread-safe).
+Wall times of every stage and every loaded resource are reported at the end.
+
+Usage: ``python pipeline.py [pipeline.toml]``
+"""
+
+import importlib
+import sys
+import threading
+import time
+import tomllib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import dill
+import fabio
+import pyFAI
+
+from plot_style import apply_style
+from utils.trace import span
+
+__all__ = ["Resources", "STAGES", "run_pipeline"]
+
+
+class Resources:
+    """Thread-safe, load-once cache of calibrations, masks and frames."""
+
+    #Initialization
+    def __init__(self, base_dir: Path):
+        self._base_dir = base_dir
+        self._cache: dict[tuple, object] = {}
+        self._locks: dict[tuple, threading.Lock] = {}
+        self._guard = threading.Lock()
+        self.timings: dict[str, float] = {}
+
+    #Private Methods
+    def _get(self, key: tuple, load):
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:  # concurrent requests for the same resource wait for one load
+            if key not in self._cache:
+                t0 = time.perf_counter()
+                with span(f"load {key[0]}"):
+                    self._cache[key] = load()
+                label = " ".join([key[0], Path(key[1]).name, *map(str, key[2:])])
+                self.timings[label] = time.perf_counter() - t0
+            return self._cache[key]
+
+    #Public Methods
+    def path(self, value: str) -> Path:
+        return (self._base_dir / value).resolve()
+
+    def calib(self, value: str):
+        path = self.path(value)
+        return self._get(("calib", path), lambda: pyFAI.load(str(path)))
+
+    def mask(self, value: str):
+        path = self.path(value)
+        return self._get(("mask", path), lambda: fabio.open(path).data.astype(bool))
+
+    def frame(self, value: str, frame: int = 0):
+        """Frame *frame* of an image file; callers must not modify it in place."""
+        path = self.path(value)
+        return self._get(("frame", path, frame), lambda: fabio.open(path, frame=frame).data)
+
+    def peaks(self, value: str):
+        path = self.path(value)
+
+        def load():
+            with open(path, "rb") as f:
+                return dill.load(f)
+
+        return self._get(("peaks", path), load)
+
+
+# === Stages ===
+def stage_iq(res: Resources, cfg: dict, output_path: Path):
+    import iq
+
+    input_path, iq_path = res.path(cfg.get("input_dir", ".")), res.path(cfg.get("output_dir", "iq"))
+    if "samples" in cfg:  # bulk mode against shared references
+        scales_file = res.path(cfg["scales_file"]) if "scales_file" in cfg else None
+        iq.run_bulk(input_path, iq_path, res.calib(cfg["calib"]), res.mask(cfg["mask"]),
+                    cfg["samples"], cfg.get("references", iq.REFERENCES), scales_file)
+    else:
+        iq.run_iq(input_path, iq_path, res.calib(cfg["calib"]), res.mask(cfg["mask"]))
+
+def stage_powder(res: Resources, cfg: dict, output_path: Path):
+    import plot_powder
+
+    plot_powder.plot_powder(res.frame(cfg["file"]), res.calib(cfg["calib"]), res.mask(cfg["mask"]), output_path)
+
+def stage_shower(res: Resources, cfg: dict, output_path: Path):
+    import plot_shower
+
+    frame = res.frame(cfg["file"], cfg.get("frame", 500))
+    plot_shower.plot_single(frame, res.calib(cfg["calib"]), res.mask(cfg["mask"]), output_path)
+
+def stage_peaks(res: Resources, cfg: dict, output_path: Path):
+    import plot_peaks
+
+    plot_peaks.plot_peaks_figures(res.peaks(cfg["file"]), res.calib(cfg["calib"]), output_path)
+
+STAGES = {
+    "iq": stage_iq,
+    "powder": stage_powder,
+    "shower": stage_shower,
+    "peaks": stage_peaks,
+}
+STAGE_MODULES = {"iq": "iq", "powder": "plot_powder", "shower": "plot_shower", "peaks": "plot_peaks"}
+
+
+def run_pipeline(config_path: str | Path) -> dict[str, float]:
+    """Run every stage listed in the config, returns the per-stage wall times."""
+    config_path = Path(config_path).resolve()
+    with open(config_path, "rb") as f:
+        config = tomllib.load(f)
+
+    # Stage settings inherit the top-level calib/mask unless they override them
+    shared = {key: config[key] for key in ("calib", "mask") if key in config}
+    stages = {name: {**shared, **cfg} for name, cfg in config.get("stages", {}).items()}
+    for name, cfg in stages.items():
+        if name not in STAGES:
+            raise ValueError(f"Unknown stage {name!r}, expected one of {list(STAGES)}")
+        for dep in cfg.get("after", []):
+            if dep not in stages:
+                raise ValueError(f"Stage {name!r} depends on {dep!r}, which is not configured")
+        # Imported up-front: the scripts apply the default style on import
+        importlib.import_module(STAGE_MODULES[name])
+
+    apply_style(**config.get("style", {}))
+    res = Resources(config_path.parent)
+    output_path = res.path(config.get("output_dir", "plot"))
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    timings: dict[str, float] = {}
+
+    def timed(name: str):
+        t0 = time.perf_counter()
+        with span(f"stage {name}"):
+            STAGES[name](res, stages[name], output_path)
+        timings[name] = time.perf_counter() - t0
+
+    pending = dict(stages)
+    done: set[str] = set()
+    t_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=config.get("workers")) as pool:
+        running = {}
+        while pending or running:
+            for name in [n for n, cfg in pending.items() if set(cfg.get("after", [])) <= done]:
+                running[pool.submit(timed, name)] = name
+                del pending[name]
+            if not running:
+                raise ValueError(f"Dependency cycle between stages {sorted(pending)}")
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done.add(running.pop(future))
+    total = time.perf_counter() - t_start
+
+    # === Report ===
+    print(f"{'stage':<40} {'wall [s]':>10}")
+    for name, seconds in timings.items():
+        print(f"{name:<40} {seconds:>10.2f}")
+    for name, seconds in res.timings.items():
+        print(f"{'load ' + name:<40} {seconds:>10.2f}")
+    print(f"{'total':<40} {total:>10.2f}")
+    return timings
+
+
+if __name__ == "__main__":
+    run_pipeline(sys.argv[1] if len(sys.argv) > 1 else "pipeline.toml")
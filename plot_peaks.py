@@ -3,12 +3,14 @@ sys.path.append("/Users/jack/workspace/own/sx-shower-scripts/extract_peak")
 
 import numpy as np
 import dill
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
 import pyFAI
 from pathlib import Path
 from itertools import chain
 from utils.rot import det2q
-from plot_style import apply_style
+from plot_style import FIGURE_LOCK, apply_style
+from utils.trace import span
 
 apply_style()
 
@@ -22,17 +24,15 @@ input_path = Path(INPUT_DIR).resolve() / FILE_NAME
 calib_path = Path(CALIB_DIR).resolve() / "calib.poni"
 mask_path = Path(CALIB_DIR).resolve() / "mask.edf"
 output_path = Path(OUTPUT_DIR).resolve()
-output_path.mkdir(parents=True, exist_ok=True)
 
-# Load data
-with open(input_path, "rb") as f:
-    peaks = dill.load(f)
-
-peaks_flattened = list(chain.from_iterable(peaks.values()))
-peaks_coordinate = list(map(lambda peak: peak.coordinate, peaks_flattened))
-ai = pyFAI.load(str(calib_path))
+# Plotting colors
+colors = [
+    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
+    '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
+    '#bcbd22', '#17becf', '#000000', '#ffffff'
+]
 
-def plot_peaks(ax, point_1, point_2, color, correct):
+def plot_peaks(ax, point_1, point_2, color, correct, ai):
     """Convert detector coordinates to q-space and plot"""
     q1_1, q2_1, _ = det2q((point_1[1], point_1[0], 0), ai)
     q1_2, q2_2, _ = det2q((point_2[1], point_2[0], 0), ai)
@@ -49,94 +49,70 @@ def plot_peaks(ax, point_1, point_2, color, correct):
     
     return np.sqrt(q1_1**2 + q2_1**2), np.sqrt(q1_2**2 + q2_2**2)
 
-# Plotting colors
-colors = [
-    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728',
-    '#9467bd', '#8c564b', '#e377c2', '#7f7f7f',
-    '#bcbd22', '#17becf', '#000000', '#ffffff'
-]
-
-# Create figure
-fig, axes = plt.subplots(1, 2, figsize=(10, 4))
-
-# Plot uncorrected peaks
-q_values = []
-for i in range(0, len(peaks_coordinate), 2):
-    point_1 = peaks_coordinate[i]
-    point_2 = peaks_coordinate[i+1]
-    q1, q2 = plot_peaks(axes[0], point_1, point_2, colors[(i//2) % len(colors)], correct=False)
-    plot_peaks(axes[1], point_1, point_2, colors[(i//2) % len(colors)], correct=False)
-    q_values.extend([q1, q2])
-
-circle_out = plt.Circle((0, 0), max(q_values), edgecolor='red', facecolor='none', lw=1, linestyle='-.')
-circle_in = plt.Circle((0, 0), min(q_values), edgecolor='blue', facecolor='none', lw=1, linestyle='-.')
-axes[0].add_artist(circle_out)
-axes[0].add_artist(circle_in)
-
-axes[0].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
-axes[0].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
-axes[1].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
-axes[1].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
-axes[0].set_xlim(-0.01, 0.01)
-axes[0].set_ylim(-0.01, 0.01)
-axes[1].set_xlim(-0.001, 0.001)
-axes[1].set_ylim(-0.001, 0.001)
-axes[0].set_aspect('equal')
-axes[1].set_aspect('equal')
-axes[0].set_xticks([-0.01, -0.005, 0, 0.005, 0.01])
-axes[0].set_yticks([-0.01, -0.005, 0, 0.005, 0.01])
-axes[1].set_xticks([-0.001, -0.0005, 0, 0.0005, 0.001])
-axes[1].set_yticks([-0.001, -0.0005, 0, 0.0005, 0.001])
-
-# Titles
-axes[0].set_title('a) q-space')
-axes[1].set_title('b) q-space, zoomed')
-plt.suptitle(f"Uncorrected, ring width: {0.0006:.1e} [1/A]")
-
-plt.tight_layout()
-plt.savefig(output_path / 'peaks_uncorrected.pdf')
-plt.close(fig)
-
-# Create figure
-fig, axes = plt.subplots(1, 2, figsize=(10, 4))
-
-# Plot corrected peaks
-q_values = []
-for i in range(0, len(peaks_coordinate), 2):
-    point_1 = peaks_coordinate[i]
-    point_2 = peaks_coordinate[i+1]
-    q1, q2 = plot_peaks(axes[0], point_1, point_2, colors[(i//2) % len(colors)], correct=True)
-    plot_peaks(axes[1], point_1, point_2, colors[(i//2) % len(colors)], correct=True)
-    q_values.extend([q1, q2])
-
-circle_out = plt.Circle((0, 0), max(q_values), edgecolor='red', facecolor='none', lw=1, linestyle='-.')
-circle_in = plt.Circle((0, 0), min(q_values), edgecolor='blue', facecolor='none', lw=1, linestyle='-.')
-axes[0].add_artist(circle_out)
-axes[0].add_artist(circle_in)
-
-axes[0].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
-axes[0].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
-axes[1].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
-axes[1].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
-axes[0].set_xlim(-0.01, 0.01)
-axes[0].set_ylim(-0.01, 0.01)
-axes[1].set_xlim(-0.001, 0.001)
-axes[1].set_ylim(-0.001, 0.001)
-axes[0].set_aspect('equal')
-axes[1].set_aspect('equal')
-axes[0].set_xticks([-0.01, -0.005, 0, 0.005, 0.01])
-axes[0].set_yticks([-0.01, -0.005, 0, 0.005, 0.01])
-axes[1].set_xticks([-0.001, -0.0005, 0, 0.0005, 0.001])
-axes[1].set_yticks([-0.001, -0.0005, 0, 0.0005, 0.001])
-
-# Titles
-axes[0].set_title('a) q-space')
-axes[1].set_title('b) q-space, zoomed')
-plt.suptitle(f"Corrected, ring width: {0.0001:.1e} [1/A]")
-
-plt.tight_layout()
-plt.savefig(output_path / 'peaks_corrected.pdf')
-plt.close(fig)
-
-
-
+def plot_peak_pairs(peaks_coordinate, ai, correct, title, path):
+    """Render consecutive peak pairs in q-space, full and zoomed"""
+    with FIGURE_LOCK:
+        # Create figure (object API, one figure at a time across threads)
+        fig = Figure(figsize=(10, 4))
+        axes = fig.subplots(1, 2)
+
+        # Plot peaks
+        q_values = []
+        for i in range(0, len(peaks_coordinate), 2):
+            point_1 = peaks_coordinate[i]
+            point_2 = peaks_coordinate[i+1]
+            q1, q2 = plot_peaks(axes[0], point_1, point_2, colors[(i//2) % len(colors)], correct, ai)
+            plot_peaks(axes[1], point_1, point_2, colors[(i//2) % len(colors)], correct, ai)
+            q_values.extend([q1, q2])
+
+        circle_out = Circle((0, 0), max(q_values), edgecolor='red', facecolor='none', lw=1, linestyle='-.')
+        circle_in = Circle((0, 0), min(q_values), edgecolor='blue', facecolor='none', lw=1, linestyle='-.')
+        axes[0].add_artist(circle_out)
+        axes[0].add_artist(circle_in)
+
+        axes[0].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
+        axes[0].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
+        axes[1].set_xlabel(r'q$_{\mathrm{x}}$ [A$^{-1}$]')
+        axes[1].set_ylabel(r'q$_{\mathrm{y}}$ [A$^{-1}$]')
+        axes[0].set_xlim(-0.01, 0.01)
+        axes[0].set_ylim(-0.01, 0.01)
+        axes[1].set_xlim(-0.001, 0.001)
+        axes[1].set_ylim(-0.001, 0.001)
+        axes[0].set_aspect('equal')
+        axes[1].set_aspect('equal')
+        axes[0].set_xticks([-0.01, -0.005, 0, 0.005, 0.01])
+        axes[0].set_yticks([-0.01, -0.005, 0, 0.005, 0.01])
+        axes[1].set_xticks([-0.001, -0.0005, 0, 0.0005, 0.001])
+        axes[1].set_yticks([-0.001, -0.0005, 0, 0.0005, 0.001])
+
+        # Titles
+        axes[0].set_title('a) q-space')
+        axes[1].set_title('b) q-space, zoomed')
+        fig.suptitle(title)
+
+        with span("savefig"):
+            fig.tight_layout()
+            fig.savefig(path)
+    return path
+
+def plot_peaks_figures(peaks, ai, output_path):
+    """Render the uncorrected and corrected peak figures, returns the output files"""
+    peaks_flattened = list(chain.from_iterable(peaks.values()))
+    peaks_coordinate = list(map(lambda peak: peak.coordinate, peaks_flattened))
+    return [
+        plot_peak_pairs(peaks_coordinate, ai, False, f"Uncorrected, ring width: {0.0006:.1e} [1/A]",
+                        output_path / 'peaks_uncorrected.pdf'),
+        plot_peak_pairs(peaks_coordinate, ai, True, f"Corrected, ring width: {0.0001:.1e} [1/A]",
+                        output_path / 'peaks_corrected.pdf'),
+    ]
+
+
+if __name__ == "__main__":
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # Load data
+    with open(input_path, "rb") as f:
+        peaks = dill.load(f)
+    ai = pyFAI.load(str(calib_path))
+
+    plot_peaks_figures(peaks, ai, output_path)
@@ -1,11 +1,17 @@
 import os
 import numpy as np
 import fabio
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import lru_cache
 from pathlib import Path
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import pyFAI
 from matplotlib.patches import Rectangle
-from plot_style import apply_style
+from plot_style import FIGURE_LOCK, apply_style
+from utils.cake import open_cube
+from utils.frames import open_frames
+from utils.stats import project_frames
+from utils.trace import flush_worker, span
 
 apply_style()
 
@@ -14,66 +20,192 @@ INPUT_DIR = "shower_cubic_normal_5"
 CALIB_DIR = "agbh_jun_2024"
 OUTPUT_DIR = "plot"
 FILE_NAME = "Diamond_shower_normal_SiO2_5_master.h5"
+FRAME = 500
+
+# Batch mode: None renders FRAME only, "frames" one figure per frame in FRAMES,
+# "ranges" one max-projection figure per RANGE_SIZE frames, plus full-series max/sum
+BATCH = None
+FRAMES = range(0, 1000, 50)
+RANGE_SIZE = 100
+WORKERS = None  # processes, None = all cores
+CUBE_NAME = "cake.npy"  # slice i_2d from this cube (cake_shower.py) when it exists
 
 input_path = Path(INPUT_DIR).resolve() / FILE_NAME
 calib_path = Path(CALIB_DIR).resolve() / "calib.poni"
 mask_path = Path(CALIB_DIR).resolve() / "mask.edf"
+cube_path = Path(INPUT_DIR).resolve() / CUBE_NAME
 output_path = Path(OUTPUT_DIR).resolve()
-output_path.mkdir(parents=True, exist_ok=True)
-
-# Load data
-img = fabio.open(input_path, frame=500).data
-
-ai = pyFAI.load(str(calib_path))
-mask = fabio.open(mask_path).data.astype(bool)
-img[mask] = 0
-
-# Perform integrations
-i_2d, q_2d, phi_2d = ai.integrate2d(img, 200, 180, unit='q_A^-1', mask=mask, radial_range=[0, 0.025])
-
-# Create figure
-fig, axes = plt.subplots(1, 3, figsize=(10, 4))
-
-# Panel 1: Original image
-axes[0].imshow(img, cmap='hot', vmin=0, vmax=500)
-axes[0].set_xlim(1400, 1800)
-axes[0].set_ylim(2000, 1600)
-axes[0].set_title('a) Original image')
-axes[0].axis('off')
-
-# Panel 2: Transformed coordinates with zoom rectangle
-axes[1].imshow(i_2d, cmap='hot', vmin=0, vmax=500, aspect='auto', 
-            extent=[min(q_2d), max(q_2d), min(phi_2d), max(phi_2d)])
-axes[1].set_xlim(0, 0.02)
-axes[1].set_ylim(-180, 180)
-axes[1].set_xlabel('q [A$^{-1}$]')
-axes[1].set_ylabel(r'$\chi$ [deg]')
-axes[1].set_title('b) 2D integration')
-
-# Add zoom rectangle
-zoom_area = Rectangle((0.006, -180), 0.002, 360, linewidth=1, edgecolor='white', facecolor='none')
-axes[1].add_patch(zoom_area)
-
-# Panel 3: Zoomed peaks with lines
-axes[2].imshow(i_2d, cmap='hot', vmin=0, vmax=500, aspect='auto',
-            extent=[min(q_2d), max(q_2d), min(phi_2d), max(phi_2d)])
-axes[2].set_xlim(0.006, 0.008)
-axes[2].set_ylim(-180, 180)
-axes[2].set_xlabel('q [A$^{-1}$]')
-axes[2].set_ylabel(r'$\chi$ [deg]')
-axes[2].set_title('c) 2D integration, zoomed')
-
-# Add peak lines
-line_1 = [(0.00636, 0.00705), (-156, 24)]
-line_2 = [(0.00659, 0.00671), (-61, 119)]
-line_3 = [(0.00659, 0.00671), (-120, 60)]
-line_4 = [(0.00670, 0.00660), (-10, 170)]
-axes[2].plot(*line_1, color='white', linewidth=1)
-axes[2].plot(*line_2, color='white', linewidth=1)
-axes[2].plot(*line_3, color='white', linewidth=1)
-axes[2].plot(*line_4, color='white', linewidth=1)
-
-plt.suptitle(f"Peak width: {0.0003:.1e} [1/A]")
-plt.tight_layout()
-plt.savefig(output_path / 'shower.pdf')
-plt.close(fig)
\ No newline at end of file
+
+
+@lru_cache(maxsize=None)
+def load_geometry():
+    """Calibration and mask, loaded once per process."""
+    ai = pyFAI.load(str(calib_path))
+    mask = fabio.open(mask_path).data.astype(bool)
+    return ai, mask
+
+
+# Only called inside the render tasks: an HDF5 handle opened before the pool forks must not be shared
+@lru_cache(maxsize=None)
+def load_series():
+    """Frame series, opened once per process."""
+    return open_frames(input_path)
+
+
+@lru_cache(maxsize=None)
+def load_cube():
+    """Caked cube (cube, radial, azimuthal, first frame) opened once per process, None without a cube."""
+    return open_cube(cube_path) if cube_path.exists() else None
+
+
+def cake(img, frame=None):
+    """2D integration of *img*, sliced from the cube when *frame* is in it."""
+    if frame is not None and load_cube() is not None:
+        cube, q_2d, phi_2d, start = load_cube()
+        if 0 <= frame - start < cube.shape[0]:
+            return np.asarray(cube[frame - start]), q_2d, phi_2d
+    ai, mask = load_geometry()
+    return integrate_shower(img, ai, mask)
+
+
+def integrate_shower(img, ai, mask):
+    with span("pyFAI integrate2d"):
+        return ai.integrate2d(img, 200, 180, unit='q_A^-1', mask=mask, radial_range=[0, 0.025])
+
+
+def render_shower(img, i_2d, q_2d, phi_2d, title, path, vmax=500, lines=()):
+    with FIGURE_LOCK:
+        # Create figure (object API, one figure at a time across threads)
+        fig = Figure(figsize=(10, 4))
+        axes = fig.subplots(1, 3)
+
+        # Panel 1: Original image
+        axes[0].imshow(img, cmap='hot', vmin=0, vmax=vmax)
+        axes[0].set_xlim(1400, 1800)
+        axes[0].set_ylim(2000, 1600)
+        axes[0].set_title('a) Original image')
+        axes[0].axis('off')
+
+        # Panel 2: Transformed coordinates with zoom rectangle
+        axes[1].imshow(i_2d, cmap='hot', vmin=0, vmax=vmax, aspect='auto',
+                    extent=[min(q_2d), max(q_2d), min(phi_2d), max(phi_2d)])
+        axes[1].set_xlim(0, 0.02)
+        axes[1].set_ylim(-180, 180)
+        axes[1].set_xlabel('q [A$^{-1}$]')
+        axes[1].set_ylabel(r'$\chi$ [deg]')
+        axes[1].set_title('b) 2D integration')
+
+        # Add zoom rectangle
+        zoom_area = Rectangle((0.006, -180), 0.002, 360, linewidth=1, edgecolor='white', facecolor='none')
+        axes[1].add_patch(zoom_area)
+
+        # Panel 3: Zoomed peaks
+        axes[2].imshow(i_2d, cmap='hot', vmin=0, vmax=vmax, aspect='auto',
+                    extent=[min(q_2d), max(q_2d), min(phi_2d), max(phi_2d)])
+        axes[2].set_xlim(0.006, 0.008)
+        axes[2].set_ylim(-180, 180)
+        axes[2].set_xlabel('q [A$^{-1}$]')
+        axes[2].set_ylabel(r'$\chi$ [deg]')
+        axes[2].set_title('c) 2D integration, zoomed')
+
+        # Add peak lines
+        for line in lines:
+            axes[2].plot(*line, color='white', linewidth=1)
+
+        fig.suptitle(title)
+        with span("savefig"):
+            fig.tight_layout()
+            fig.savefig(path)
+    return path
+
+
+def render_frame(frame):
+    """Render the figure of a single frame, returns the output path."""
+    _, mask = load_geometry()
+    img = load_series().get_frame(frame).data
+    img[mask] = 0
+    i_2d, q_2d, phi_2d = cake(img, frame)
+    path = render_shower(img, i_2d, q_2d, phi_2d, f"Frame {frame}", output_path / f'shower_{frame:05d}.pdf')
+    flush_worker()
+    return path
+
+
+def render_range(start, stop):
+    """Stream frames [start, stop) once, render their max projection and return it for merging."""
+    _, mask = load_geometry()
+    projection = project_frames(input_path, start, stop)
+    img = projection.max.copy()
+    img[mask] = 0
+    i_2d, q_2d, phi_2d = cake(img)
+    render_shower(img, i_2d, q_2d, phi_2d, f"Max projection, frames {start}-{stop - 1}",
+                  output_path / f'shower_max_{start:05d}_{stop - 1:05d}.pdf')
+    flush_worker()
+    return projection
+
+
+def plot_single(img, ai, mask, output_path):
+    """Render the annotated single-frame figure, returns the output file."""
+    img = img.copy()
+    img[mask] = 0
+
+    # Perform integrations
+    i_2d, q_2d, phi_2d = integrate_shower(img, ai, mask)
+
+    # Peak lines
+    line_1 = [(0.00636, 0.00705), (-156, 24)]
+    line_2 = [(0.00659, 0.00671), (-61, 119)]
+    line_3 = [(0.00659, 0.00671), (-120, 60)]
+    line_4 = [(0.00670, 0.00660), (-10, 170)]
+    return render_shower(img, i_2d, q_2d, phi_2d, f"Peak width: {0.0003:.1e} [1/A]", output_path / 'shower.pdf',
+                         lines=(line_1, line_2, line_3, line_4))
+
+
+def merge_projections(projection, futures):
+    # Projections merge in any order (max and sum), each result is dropped once folded in
+    for future in futures:
+        if projection is None:
+            projection = future.result()
+        else:
+            projection.merge(future.result())
+    return projection
+
+
+def run_batch():
+    with ProcessPoolExecutor(max_workers=WORKERS) as pool:
+        if BATCH == "frames":
+            for path in pool.map(render_frame, FRAMES):
+                print(path)
+            return
+
+        # Per-range figures; the range projections merge into the full-series projections as they finish,
+        # with at most one range per worker in flight so only a few projections are alive at a time
+        n_frames = open_frames(input_path).nframes
+        if n_frames == 0:
+            raise ValueError(f"No frames in {input_path}")
+        in_flight = WORKERS or os.cpu_count() or 1
+        projection, running = None, set()
+        for a in range(0, n_frames, RANGE_SIZE):
+            if len(running) >= in_flight:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                projection = merge_projections(projection, finished)
+            running.add(pool.submit(render_range, a, min(a + RANGE_SIZE, n_frames)))
+        projection = merge_projections(projection, running)
+
+    _, mask = load_geometry()
+    for name, img, vmax in (("max", projection.max, 500), ("sum", projection.sum, None)):
+        img = img.copy()
+        img[mask] = 0
+        i_2d, q_2d, phi_2d = cake(img)
+        render_shower(img, i_2d, q_2d, phi_2d, f"{name.capitalize()} projection, {projection.count} frames",
+                      output_path / f'shower_{name}.pdf', vmax=vmax)
+
+
+if __name__ == "__main__":
+    output_path.mkdir(parents=True, exist_ok=True)
+    if BATCH is not None:
+        run_batch()
+    else:
+        # Load data
+        img = fabio.open(input_path, frame=FRAME).data
+        ai, mask = load_geometry()
+        plot_single(img, ai, mask, output_path)
@@ -1,14 +1,47 @@
 """Utility functions to enforce a consistent Matplotlib style across all plot scripts."""
 
+import os
+import threading
+from pathlib import Path
 from typing import Mapping
 import matplotlib as mpl
 
+TEXT_MODES = ("usetex", "usetex_cached", "mathtext")
+
+# Environment overrides, so batch jobs can switch modes without editing the scripts
+TEXT_MODE_ENV = "PLOT_TEXT_MODE"
+HEADLESS_ENV = "PLOT_HEADLESS"
+TEX_CACHE_ENV = "PLOT_TEX_CACHE"
+
+# Matplotlib is not thread-safe (mathtext parser, text and TeX layout caches are shared), so threaded
+# callers such as pipeline.py hold this lock while building and saving a figure; integration stays concurrent
+FIGURE_LOCK = threading.RLock()
+
+def _set_tex_cache(cache_dir: Path) -> None:
+    """Relocate Matplotlib's TeX cache (rendered strings, keyed by source hash) to *cache_dir*.
+
+    The cache is persistent already (``tex.cache`` in the Matplotlib cache
+    directory); moving it only lets several machines or jobs share it.
+    """
+    from matplotlib.texmanager import TexManager
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Class attribute name and type differ between Matplotlib versions
+    for attr, kind in (("_cache_dir", Path), ("_texcache", str), ("texcache", str)):
+        if isinstance(vars(TexManager).get(attr), (str, Path)):
+            setattr(TexManager, attr, kind(cache_dir))
+            return
+    raise RuntimeError(f"Cannot relocate the TeX cache of Matplotlib {mpl.__version__}, use text_mode='usetex'")
+
 def apply_style(
     font_family: str = "Times New Roman",
     base_font_size: int = 10,
     title_font_size: int = 12,
     dpi: int = 300,
     use_latex: bool = True,
+    text_mode: str | None = None,
+    headless: bool | None = None,
+    tex_cache_dir: str | Path | None = None,
     **extra_rc: Mapping[str, object],
 ) -> None:
     """Apply a global Matplotlib style optimized for publication.
@@ -24,10 +57,33 @@ def apply_style(
     dpi
         Resolution for saved figures (default: 300).
     use_latex
-        Whether to enable LaTeX text rendering (default: True).
+        Whether to enable LaTeX text rendering (default: True). Ignored when
+        *text_mode* is given.
+    text_mode
+        "usetex" (LaTeX subprocess per new string, cached in Matplotlib's
+        own cache directory), "usetex_cached" (as "usetex", with that cache
+        moved to *tex_cache_dir*, e.g. a directory shared by CI jobs or
+        compute nodes) or "mathtext" (no LaTeX, STIX maths with a matching
+        serif font). Defaults to ``$PLOT_TEXT_MODE``, else follows *use_latex*.
+    headless
+        Force the non-interactive Agg backend for batch jobs (default:
+        ``$PLOT_HEADLESS``, else False).
+    tex_cache_dir
+        Directory for "usetex_cached" (default: ``$PLOT_TEX_CACHE``, else
+        ``.texcache`` next to this file).
     **extra_rc
         Additional ``matplotlib.rcParams`` overrides.
     """
+    if text_mode is None:
+        text_mode = os.environ.get(TEXT_MODE_ENV) or ("usetex" if use_latex else "mathtext")
+    if text_mode not in TEXT_MODES:
+        raise ValueError(f"`text_mode` must be one of {TEXT_MODES}, got {text_mode!r}")
+    if headless is None:
+        headless = os.environ.get(HEADLESS_ENV, "").lower() in ("1", "true", "yes")
+
+    if headless:
+        mpl.use("Agg", force=True)
+
     rc: dict[str, object] = {
         "font.family": font_family,
         "font.size": base_font_size,
@@ -46,11 +102,22 @@ def apply_style(
         "figure.figsize": (6, 4),  # Default figure size (width, height) in inches
     }
 
-    if use_latex:
+    if text_mode in ("usetex", "usetex_cached"):
         rc.update({
             "text.usetex": True,
             "text.latex.preamble": r"\usepackage{amsmath}",
         })
+        if text_mode == "usetex_cached":
+            cache_dir = tex_cache_dir or os.environ.get(TEX_CACHE_ENV) or Path(__file__).resolve().parent / ".texcache"
+            _set_tex_cache(Path(cache_dir))
+    else:
+        # Times-like STIX maths next to the serif text font, no LaTeX involved
+        rc.update({
+            "text.usetex": False,
+            "font.family": "serif",
+            "font.serif": [font_family, "STIX Two Text", "STIXGeneral", "DejaVu Serif"],
+            "mathtext.fontset": "stix",
+        })
 
     rc.update(extra_rc)
-    mpl.rcParams.update(rc) 
\ No newline at end of file
+    mpl.rcParams.update(rc)
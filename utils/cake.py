@@ -0,0 +1,142 @@
+"""Batch 2D integration ("caking") of whole image series.
+
+The (chi, q) integration is expressed once as a sparse matrix that maps the
+valid detector pixels onto the output bins, the same binning ``integrate2d``
+does without pixel splitting. Caking a frame is then a single sparse
+matrix product. Frame ranges are decoded and caked in a process pool (the
+HDF5 decode holds a global lock, threads would run it one at a time), each
+worker writing its own range of a memory-mapped ``(n_frames, npt_azim,
+npt_rad)`` cube.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse
+
+from utils.frames import open_frames, split_frames
+from utils.pixels import PixelIndex
+from utils.trace import flush_worker, span, traced
+
+__all__ = ["CakeEngine", "cake_series", "open_cube"]
+
+
+class CakeEngine:
+    """Precomputed sparse (chi, q) integration matrix for one geometry and mask."""
+
+    #Initialization
+    def __init__(
+        self,
+        ai,
+        pixels: PixelIndex,
+        npt_rad: int = 200,
+        npt_azim: int = 180,
+        unit: str = "q_A^-1",
+        radial_range: tuple[float, float] = (0, 0.025),
+        correct_solid_angle: bool = True,
+    ):
+        self.pixels = pixels
+        self.npt_rad = npt_rad
+        self.npt_azim = npt_azim
+
+        radial = pixels.compact(ai.array_from_unit(pixels.shape, "center", unit, scale=True))
+        chi = pixels.compact(np.rad2deg(ai.chiArray(pixels.shape))) # unit (deg)
+
+        radial_edges = np.linspace(radial_range[0], radial_range[1], npt_rad + 1)
+        azimuthal_edges = np.linspace(-180, 180, npt_azim + 1)
+        self.radial = (radial_edges[:-1] + radial_edges[1:]) / 2
+        self.azimuthal = (azimuthal_edges[:-1] + azimuthal_edges[1:]) / 2
+
+        i_rad = np.floor((radial - radial_range[0]) / (radial_range[1] - radial_range[0]) * npt_rad).astype(np.int64)
+        i_azim = np.clip(np.floor((chi + 180) / 360 * npt_azim).astype(np.int64), 0, npt_azim - 1)
+        keep = (i_rad >= 0) & (i_rad < npt_rad)
+        columns = np.flatnonzero(keep)
+
+        self.matrix = scipy.sparse.csr_matrix(
+            (np.ones(columns.size, dtype=np.float32), (i_azim[keep] * npt_rad + i_rad[keep], columns)),
+            shape=(npt_azim * npt_rad, len(pixels)),
+        )
+        # Normalisation per bin: summed solid angle (pyFAI semantics) or pixel count
+        weights = pixels.compact(ai.solidAngleArray(pixels.shape)) if correct_solid_angle else np.ones(len(pixels))
+        norm = self.matrix @ weights.astype(np.float64)
+        self._inv_norm = np.divide(1.0, norm, out=np.zeros_like(norm), where=norm > 0).astype(np.float32)
+
+    #Public Methods
+    @traced("cake")
+    def integrate(self, frames: np.ndarray) -> np.ndarray:
+        """Cake one frame (H, W) or a stack (n, H, W) into (…, npt_azim, npt_rad)."""
+        stack = frames.reshape(-1, frames.shape[-2] * frames.shape[-1])[:, self.pixels.index]
+        result = (self.matrix @ stack.T.astype(np.float32)).T * self._inv_norm
+        return result.reshape(frames.shape[:-2] + (self.npt_azim, self.npt_rad))
+
+
+def _cake_range(file_data, engine: CakeEngine, file_cube, offset: int, start: int, stop: int, chunk_frames: int) -> None:
+    # Runs in a worker process: own series handle, own writable map of the cube
+    series = open_frames(file_data)
+    cube = np.load(file_cube, mmap_mode="r+")
+    for a in range(start, stop, chunk_frames):
+        b = min(a + chunk_frames, stop)
+        with span("frame decode"):
+            frames = np.stack([series.get_frame(i).data for i in range(a, b)])
+        cube[a - offset : b - offset] = engine.integrate(frames)
+    cube.flush()
+    flush_worker()
+
+
+def cake_series(
+    file_data: str | Path,
+    file_cube: str | Path,
+    engine: CakeEngine,
+    start: int = 0,
+    stop: int | None = None,
+    workers: int | None = None,
+    chunk_frames: int = 4,
+) -> np.ndarray:
+    """Cake the frames ``[start, stop)`` of a series into a ``.npy`` cube on disk.
+
+    The cube has shape ``(stop - start, npt_azim, npt_rad)`` (float32) and is
+    written through a memory map in blocks of *chunk_frames*, each worker
+    process handling one contiguous frame range with its own file handles.
+    ``workers=1`` runs in-process. The radial and azimuthal bin centres are
+    saved next to it (``*.axes.npz``). Returns the cube opened read-only as a
+    memory map.
+    """
+    file_cube = Path(file_cube)
+    if stop is None:
+        stop = open_frames(file_data).nframes
+    if stop <= start:
+        raise ValueError(f"Empty frame range [{start}, {stop})")
+
+    # Only the header and the file size are written here, the workers fill in their ranges
+    cube = np.lib.format.open_memmap(
+        file_cube, mode="w+", dtype=np.float32, shape=(stop - start, engine.npt_azim, engine.npt_rad)
+    )
+    del cube
+
+    if workers == 1:
+        _cake_range(file_data, engine, file_cube, start, start, stop, chunk_frames)
+    else:
+        ranges = split_frames(start, stop, workers or os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=len(ranges)) as pool:
+            futures = [
+                pool.submit(_cake_range, str(file_data), engine, str(file_cube), start, a, b, chunk_frames)
+                for a, b in ranges
+            ]
+            for future in futures:
+                future.result()
+
+    np.savez(_axes_path(file_cube), radial=engine.radial, azimuthal=engine.azimuthal, start=start)
+    return np.load(file_cube, mmap_mode="r")
+
+
+def open_cube(file_cube: str | Path) -> tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Open a cube written by :func:`cake_series` as (cube, radial, azimuthal, first frame)."""
+    with np.load(_axes_path(Path(file_cube))) as axes:
+        radial, azimuthal, start = axes["radial"], axes["azimuthal"], int(axes["start"])
+    return np.load(file_cube, mmap_mode="r"), radial, azimuthal, start
+
+
+def _axes_path(file_cube: Path) -> Path:
+    return file_cube.with_suffix(".axes.npz")
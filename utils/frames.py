@@ -0,0 +1,174 @@
+"""Frame sources for raw and sparse image series.
+
+Shower frames are almost entirely zero, so a series can be stored as the flat
+pixel indices and values above a threshold, concatenated over all frames, plus
+an ``offset`` array where frame *i* spans ``offset[i]:offset[i + 1]``. The
+:class:`SparseSeries` reader exposes the same ``nframes``/``get_frame(i).data``
+interface as ``fabio.open_series`` so the two are interchangeable.
+"""
+
+from pathlib import Path
+
+import fabio
+import h5py
+import numpy as np
+
+__all__ = [
+    "SANITIZE_MIN",
+    "SANITIZE_MAX",
+    "SPARSE_SUFFIX",
+    "sanitize",
+    "open_frames",
+    "split_frames",
+    "convert_series",
+    "SparseFrame",
+    "SparseSeries",
+]
+
+# Domain-specific clean-up bounds (gaps, hot and overflowing pixels)
+SANITIZE_MIN = 0
+SANITIZE_MAX = 10000
+
+SPARSE_SUFFIX = ".sparse.h5"
+
+
+def sanitize(img: np.ndarray) -> np.ndarray:
+    """Return *img* as ``int32`` with values outside the clean-up bounds set to 0."""
+    img = img.astype(np.int32)
+    img[img > SANITIZE_MAX] = 0
+    img[img < SANITIZE_MIN] = 0
+    return img
+
+
+def open_frames(file_data: str | Path):
+    """Open a raw (fabio) or sparse (``*.sparse.h5``) series by file name."""
+    file_data = Path(file_data)
+    if file_data.name.endswith(SPARSE_SUFFIX):
+        return SparseSeries(file_data)
+    return fabio.open_series(first_filename=str(file_data))
+
+
+def split_frames(start: int, stop: int, parts: int) -> list[tuple[int, int]]:
+    """Split the frame range ``[start, stop)`` into at most *parts* contiguous ranges."""
+    edges = np.linspace(start, stop, max(1, min(parts, stop - start)) + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:]) if b > a]
+
+
+def convert_series(
+    file_data: str | Path,
+    file_sparse: str | Path,
+    threshold: int = 0,
+    mask: np.ndarray | None = None,
+    flush_frames: int = 100,
+) -> None:
+    """Stream a raw series into the sparse per-frame format.
+
+    Pixels are kept if their sanitised value is above *threshold* and they are
+    not in *mask*. Frames are written in batches of *flush_frames* so memory
+    stays bounded by the sparse size of one batch.
+    """
+    series = fabio.open_series(first_filename=str(file_data))
+    valid = None if mask is None else ~np.asarray(mask, dtype=bool).reshape(-1)
+
+    with h5py.File(file_sparse, "w") as f:
+        index = f.create_dataset("index", shape=(0,), maxshape=(None,), dtype=np.uint32, chunks=(1 << 16,), compression="lzf")
+        value = f.create_dataset("value", shape=(0,), maxshape=(None,), dtype=np.int32, chunks=(1 << 16,), compression="lzf")
+        offsets = np.zeros(series.nframes + 1, dtype=np.int64)
+
+        buffer_index: list[np.ndarray] = []
+        buffer_value: list[np.ndarray] = []
+
+        def flush():
+            if not buffer_index:
+                return
+            start = index.shape[0]
+            batch_index = np.concatenate(buffer_index)
+            stop = start + batch_index.size
+            index.resize((stop,))
+            value.resize((stop,))
+            index[start:stop] = batch_index
+            value[start:stop] = np.concatenate(buffer_value)
+            buffer_index.clear()
+            buffer_value.clear()
+
+        for i in range(series.nframes):
+            frame_data = series.get_frame(i).data
+            if i == 0:
+                f.attrs["shape"] = frame_data.shape
+            img = sanitize(frame_data).reshape(-1)
+            keep = img > threshold
+            if valid is not None:
+                keep &= valid
+            pixels = np.flatnonzero(keep)
+            buffer_index.append(pixels.astype(np.uint32))
+            buffer_value.append(img[pixels])
+            offsets[i + 1] = offsets[i] + pixels.size
+            if (i + 1) % flush_frames == 0:
+                flush()
+        flush()
+
+        f.create_dataset("offset", data=offsets)
+        f.attrs["threshold"] = threshold
+        f.attrs["source"] = str(file_data)
+
+
+class SparseFrame:
+    """One frame of a :class:`SparseSeries`, densified on access to *data*."""
+
+    #Initialization
+    def __init__(self, index: np.ndarray, value: np.ndarray, shape: tuple[int, int]):
+        self.index = index
+        self.value = value
+        self.shape = shape
+
+    #Public Methods
+    @property
+    def data(self) -> np.ndarray:
+        img = np.zeros(self.shape, dtype=np.int32)
+        img.reshape(-1)[self.index] = self.value
+        return img
+
+
+class SparseSeries:
+    """Reader for the sparse per-frame format written by :func:`convert_series`."""
+
+    #Initialization
+    def __init__(self, file_sparse: str | Path):
+        self._file = h5py.File(file_sparse, "r")
+        self.shape: tuple[int, int] = tuple(int(n) for n in self._file.attrs["shape"])
+        self.threshold = int(self._file.attrs["threshold"])
+        self.offsets: np.ndarray = self._file["offset"][()]
+        self.nframes: int = self.offsets.size - 1
+
+    def __len__(self) -> int:
+        return self.nframes
+
+    #Public Methods
+    def pixels(self, idx: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (flat index, value) arrays of frame *idx*."""
+        if not (0 <= idx < self.nframes):
+            raise ValueError("Frame index out of bounds")
+        start, stop = self.offsets[idx], self.offsets[idx + 1]
+        return self._file["index"][start:stop].astype(np.int64), self._file["value"][start:stop]
+
+    def get_frame(self, idx: int) -> SparseFrame:
+        return SparseFrame(*self.pixels(idx), self.shape)
+
+    def iter_chunks(self, start: int = 0, stop: int | None = None, chunk_frames: int = 1000):
+        """Yield (first frame, stop frame, flat index, value) of contiguous chunks of frames."""
+        stop = self.nframes if stop is None else stop
+        for chunk_start in range(start, stop, chunk_frames):
+            chunk_stop = min(chunk_start + chunk_frames, stop)
+            base, end = self.offsets[chunk_start], self.offsets[chunk_stop]
+            yield chunk_start, chunk_stop, self._file["index"][base:end].astype(np.int64), self._file["value"][base:end]
+
+    def iter_pixels(self, start: int = 0, stop: int | None = None, chunk_frames: int = 1000):
+        """Yield (frame, flat index, value) for a frame range, reading in large contiguous chunks."""
+        for chunk_start, chunk_stop, index, value in self.iter_chunks(start, stop, chunk_frames):
+            base = self.offsets[chunk_start]
+            for i in range(chunk_start, chunk_stop):
+                a, b = self.offsets[i] - base, self.offsets[i + 1] - base
+                yield i, index[a:b], value[a:b]
+
+    def close(self) -> None:
+        self._file.close()
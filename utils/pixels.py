@@ -0,0 +1,75 @@
+import fabio
+import numpy as np
+
+from utils.rot import det2q_pixels
+
+
+class PixelIndex:
+    """Compacted representation of the valid (unmasked) pixels of a detector.
+
+    Holds the flat index of every pixel where *mask* is False, so that
+    geometry, binning and integration only ever see valid pixels. Gaps,
+    module edges and beamstop shadows then cost nothing and averages count
+    valid pixels only.
+    """
+
+    #Initialization
+    def __init__(self, mask: np.ndarray):
+        mask = np.asarray(mask, dtype=bool)
+        self.shape: tuple[int, int] = mask.shape
+        # int32 halves the index of any detector below 2**31 pixels, rows/cols are derived per block
+        dtype = np.int32 if mask.size < 2**31 else np.intp
+        self.index = np.flatnonzero(~mask).astype(dtype)
+        self._qcache: dict[tuple, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_file(cls, mask_path) -> "PixelIndex":
+        """Build the index from a mask image (e.g. ``mask.edf``), non-zero = masked."""
+        return cls(fabio.open(str(mask_path)).data.astype(bool))
+
+    def __len__(self) -> int:
+        return self.index.size
+
+    def __repr__(self) -> str:  # pragma: no cover – purely cosmetic
+        return f"PixelIndex(valid={len(self)}/{self.shape[0] * self.shape[1]})"
+
+    #Public Methods
+    def compact(self, img: np.ndarray) -> np.ndarray:
+        """Return the values of the valid pixels of *img* as a 1D array."""
+        if img.shape != self.shape:
+            raise ValueError(f"Image shape {img.shape} does not match mask shape {self.shape}")
+        return img.reshape(-1)[self.index]
+
+    def expand(self, values: np.ndarray, fill=0) -> np.ndarray:
+        """Scatter compacted *values* back into a full detector image."""
+        img = np.full(self.shape, fill, dtype=np.asarray(values).dtype)
+        img.reshape(-1)[self.index] = values
+        return img
+
+    def coords(self, block: slice = slice(None)) -> tuple[np.ndarray, np.ndarray]:
+        """Return the (row, column) detector coordinates of the valid pixels in *block*."""
+        return np.divmod(self.index[block], self.shape[1]) # unit (px, px)
+
+    def qpoints(self, ai, dtype=np.float64, zrot=0, block: slice = slice(None), cache: bool = False):
+        """Return (q1, q2, q3) of the valid pixels in *block*.
+
+        With *cache* the q-points of all valid pixels are computed once per
+        geometry and kept (three floats per valid pixel), later calls only
+        slice them. Without it only the requested block is converted.
+        """
+        if not cache:
+            return det2q_pixels(*self.coords(block), ai, zrot, dtype)
+        key = (_geometry(ai), np.dtype(dtype).str, zrot)
+        if key not in self._qcache:
+            self._qcache[key] = det2q_pixels(*self.coords(), ai, zrot, dtype)
+        return tuple(q[block] for q in self._qcache[key])
+
+    def blocks(self, block_size: int):
+        """Yield slices over the compacted pixels of at most *block_size* entries."""
+        for start in range(0, len(self), block_size):
+            yield slice(start, min(start + block_size, len(self)))
+
+
+def _geometry(ai) -> tuple[float, ...]:
+    # Everything det2q_pixels reads from the integrator, a refined or reloaded geometry gets a new key
+    return (ai.dist, ai.poni1, ai.poni2, ai.rot1, ai.rot2, ai.rot3, ai.wavelength, ai.pixel1, ai.pixel2)
@@ -1,5 +1,8 @@
 import numpy as np
 
+from utils.trace import span, traced
+from utils.voxel import SparseQGrid
+
 def det2q(point, ai):
     # 1=vertical, 2=horizontal, origin at bottom left, 3=sample-detector
     d1, d2, zrot = point # unit (px, px, deg)
@@ -23,6 +26,34 @@ def det2q(point, ai):
 
     return q1, q2p, q3p
 
+@traced()
+def det2q_pixels(d1, d2, ai, zrot=0, dtype=np.float64):
+    # Vectorised det2q for flat pixel index arrays, plain float arithmetic instead of object arrays
+    R = ai.rotation_matrix().astype(dtype)
+    dn1 = (np.asarray(d1) * ai.pixel1 - ai.poni1).astype(dtype, copy=False) # unit (m)
+    dn2 = (np.asarray(d2) * ai.pixel2 - ai.poni2).astype(dtype, copy=False) # unit (m)
+    L = np.dtype(dtype).type(ai.dist) # unit (m)
+
+    x0 = R[0, 0] * dn1 + R[0, 1] * dn2 + R[0, 2] * L # unit (m)
+    x1 = R[1, 0] * dn1 + R[1, 1] * dn2 + R[1, 2] * L # unit (m)
+    x2 = R[2, 0] * dn1 + R[2, 1] * dn2 + R[2, 2] * L # unit (m)
+    norm = np.sqrt(x0 * x0 + x1 * x1 + x2 * x2)
+    alpha = np.arctan(x0 / norm)
+    phi = np.arctan(x1 / norm)
+    del x0, x1, x2, norm
+    k = np.dtype(dtype).type(2 * np.pi / (ai.wavelength * 1e10)) # unit (1/A)
+
+    q1 = k * np.sin(alpha) # unit (1/A)
+    q2 = k * np.cos(alpha) * np.sin(phi) # unit (1/A)
+    # cos(a)cos(p) - 1 rewritten with half angles, avoids cancellation in float32
+    q3 = -k * (2 * np.sin(alpha / 2) ** 2 + np.cos(alpha) * 2 * np.sin(phi / 2) ** 2) # unit (1/A)
+
+    if zrot:
+        zrot = np.deg2rad(zrot) # unit (rad)
+        q2, q3 = np.cos(zrot) * q2 - np.sin(zrot) * q3, np.sin(zrot) * q2 + np.cos(zrot) * q3 # unit (1/A)
+
+    return q1.astype(dtype, copy=False), q2.astype(dtype, copy=False), q3.astype(dtype, copy=False)
+
 def qsize(qpoints, ai, dq):
     qx_min, qx_max = np.min(qpoints[0]), np.max(qpoints[0])
     qy_min, qy_max = np.min(qpoints[1]), np.max(qpoints[1])
@@ -39,20 +70,140 @@ def qsize(qpoints, ai, dq):
 def qrebin(qpoints, qrange, nq, intensity):
     qpoints_flatten = (qpoints[0].flatten(), qpoints[1].flatten(), qpoints[2].flatten())
     print(qpoints_flatten[0].shape)
-    I_hist, _ = np.histogramdd(qpoints_flatten, bins=nq, range=qrange, weights=intensity.flatten())
-    n_hist, _ = np.histogramdd(qpoints_flatten, bins=nq, range=qrange)
+    with span("histogramdd"):
+        I_hist, _ = np.histogramdd(qpoints_flatten, bins=nq, range=qrange, weights=intensity.flatten())
+        n_hist, _ = np.histogramdd(qpoints_flatten, bins=nq, range=qrange)
     I_hist[n_hist > 0] /= n_hist[n_hist > 0]
 
     return I_hist
 
-def qtransform(img, ai, dq):
+@traced("histogram block")
+def qrebin_add(qpoints, qrange, nq, intensity, I_hist, n_hist):
+    # In-place histogramdd of one block, only the occupied bins are touched (no full-size temporaries)
+    idx = np.zeros(np.size(qpoints[0]), dtype=np.int64)
+    keep = np.ones(idx.size, dtype=bool)
+    for axis in range(3):
+        q = np.ravel(qpoints[axis])
+        edges = np.linspace(qrange[axis][0], qrange[axis][1], nq[axis] + 1)
+        i = np.searchsorted(edges, q, side='right') - 1
+        i[q == edges[-1]] -= 1 # right-most edge is inclusive, as in histogramdd
+        keep &= (i >= 0) & (i < nq[axis])
+        idx = idx * nq[axis] + i
+
+    uniq, inverse = np.unique(idx[keep], return_inverse=True)
+    I_hist.reshape(-1)[uniq] += np.bincount(inverse, weights=np.ravel(intensity)[keep], minlength=uniq.size)
+    n_hist.reshape(-1)[uniq] += np.bincount(inverse, minlength=uniq.size)
+
+def block_size(memory_mb, dtype=np.float64):
+    # Pixels per block so that the q-coordinates and binning temporaries of one block fit in memory_mb
+    bytes_per_pixel = 16 * np.dtype(dtype).itemsize + 64 # ~16 float temporaries in det2q_pixels + int64 bin indices
+    return max(1, int(memory_mb * 2**20 // bytes_per_pixel))
+
+def block_rows(shape, memory_mb, dtype=np.float64):
+    return max(1, block_size(memory_mb, dtype) // shape[1])
+
+def qblocks(shape, ai, memory_mb, dtype=np.float64, zrot=0):
+    # Yield (row slice, q-points) for row blocks of the detector, each block freed before the next
+    rows = block_rows(shape, memory_mb, dtype)
+    d2_arr = np.arange(shape[1])
+    for r0 in range(0, shape[0], rows):
+        r1 = min(r0 + rows, shape[0])
+        d1, d2 = np.meshgrid(np.arange(r0, r1), d2_arr, indexing='ij')
+        yield slice(r0, r1), det2q_pixels(d1, d2, ai, zrot, dtype)
+
+def qtransform_tiled(img, ai, dq, memory_mb=256, dtype=np.float64):
+    # Pass 1: q extent block by block, pass 2: accumulate each block into the histogram
+    lo, hi = np.full(3, np.inf), np.full(3, -np.inf)
+    for _, qpoints in qblocks(img.shape, ai, memory_mb, dtype):
+        lo = np.minimum(lo, [np.min(q) for q in qpoints])
+        hi = np.maximum(hi, [np.max(q) for q in qpoints])
+    qrange, nq = qsize(tuple(zip(lo, hi)), ai, dq)
+
+    I_hist = np.zeros(nq, dtype=np.float64)
+    n_hist = np.zeros(nq, dtype=np.int64)
+    for rows, qpoints in qblocks(img.shape, ai, memory_mb, dtype):
+        qrebin_add(qpoints, qrange, nq, img[rows], I_hist, n_hist)
+    I_hist[n_hist > 0] /= n_hist[n_hist > 0]
+
+    return I_hist
+
+def qtransform_valid(img, ai, dq, pixels, memory_mb=256, dtype=np.float64, cache=False):
+    # Only the valid pixels of a PixelIndex are converted and binned, masked pixels never enter the averages
+    # Same two passes as qtransform_tiled, q is computed per block unless the PixelIndex caches it
+    values = pixels.compact(img)
+    size = block_size(memory_mb, dtype) if memory_mb is not None else max(len(pixels), 1)
+
+    lo, hi = np.full(3, np.inf), np.full(3, -np.inf)
+    for block in pixels.blocks(size):
+        qpoints = pixels.qpoints(ai, dtype, block=block, cache=cache)
+        lo = np.minimum(lo, [np.min(q) for q in qpoints])
+        hi = np.maximum(hi, [np.max(q) for q in qpoints])
+    qrange, nq = qsize(tuple(zip(lo, hi)), ai, dq)
+
+    I_hist = np.zeros(nq, dtype=np.float64)
+    n_hist = np.zeros(nq, dtype=np.int64)
+    for block in pixels.blocks(size):
+        qrebin_add(pixels.qpoints(ai, dtype, block=block, cache=cache), qrange, nq, values[block], I_hist, n_hist)
+    I_hist[n_hist > 0] /= n_hist[n_hist > 0]
+
+    return I_hist
+
+def qtransform(img, ai, dq, memory_mb=None, dtype=np.float64, pixels=None):
+    # memory_mb=None keeps the one-shot path, otherwise the detector is processed in row blocks
+    # dtype=np.float32 halves the q temporaries, at the cost of pixels close to a bin edge changing bins
+    if pixels is not None:
+        return qtransform_valid(img, ai, dq, pixels, memory_mb, dtype)
+    if memory_mb is not None:
+        return qtransform_tiled(img, ai, dq, memory_mb, dtype)
+
     d1_arr = np.arange(img.shape[0])
     d2_arr = np.arange(img.shape[1])
     zrot_arr = 0
 
     points = np.meshgrid(d1_arr, d2_arr, zrot_arr, indexing='ij') # indexing important, default is 'xy' (swap d1 and d2)
 
-    qpoints = det2q(points, ai)
+    with span("det2q"):
+        qpoints = det2q(points, ai)
     qrange, nq = qsize(qpoints, ai, dq)
 
-    return qrebin(qpoints, qrange, nq, img)
\ No newline at end of file
+    return qrebin(qpoints, qrange, nq, img)
+
+def qrebin_sparse(qpoints, dq, intensity, grid=None):
+    # Same intensity/count semantics as qrebin, but only occupied voxels are stored
+    if grid is None:
+        grid = SparseQGrid(dq)
+    grid.add(qpoints, intensity)
+
+    return grid
+
+def qtransform_sparse(img, ai, dq, grid=None, memory_mb=256, dtype=np.float64, pixels=None):
+    # No bounding box needed, so a single tiled pass accumulates straight into the sparse grid
+    if grid is None:
+        grid = SparseQGrid(dq)
+    if pixels is not None:
+        values = pixels.compact(img)
+        for block in pixels.blocks(block_size(memory_mb, dtype)):
+            qrebin_sparse(pixels.qpoints(ai, dtype, block=block), dq, values[block], grid)
+        return grid
+    for rows, qpoints in qblocks(img.shape, ai, memory_mb, dtype):
+        qrebin_sparse(qpoints, dq, img[rows], grid)
+
+    return grid
+
+def qtransform_pixels(index, values, shape, ai, dq, grid=None, dtype=np.float64):
+    # Sparse frame input (flat pixel index + values), only the stored pixels are converted
+    if grid is None:
+        grid = SparseQGrid(dq)
+    d1, d2 = np.divmod(np.asarray(index, dtype=np.int64), shape[1])
+    qpoints = det2q_pixels(d1, d2, ai, 0, dtype)
+
+    return qrebin_sparse(qpoints, dq, values, grid)
+
+def qtransform_series(series, ai, dq, start=0, stop=None, grid=None, dtype=np.float64, chunk_frames=1000):
+    # Accumulate every frame of a SparseSeries into one sparse q-space map, one conversion per chunk of frames
+    if grid is None:
+        grid = SparseQGrid(dq)
+    for _, _, index, values in series.iter_chunks(start, stop, chunk_frames):
+        qtransform_pixels(index, values, series.shape, ai, dq, grid, dtype)
+
+    return grid
@@ -0,0 +1,202 @@
+"""Lightweight span instrumentation with Chrome trace-event export.
+
+Wrap a hot path in ``with span("name"):`` (or decorate it with ``@traced()``).
+While tracing is disabled, ``span`` returns one shared no-op context manager,
+so an instrumented call site costs a global lookup and two empty method calls.
+
+Tracing is enabled by setting ``SX_TRACE=<trace.json>`` in the environment or
+by calling :func:`enable`. At exit, the recorded spans are written as Chrome
+trace-event JSON (open in ``chrome://tracing`` or Perfetto), and a per-stage
+summary is printed. Worker processes write their own ``<trace>.<pid>.json``
+through :func:`flush_worker`, called at the end of each worker task: forked
+pool workers leave through ``os._exit`` and never run the exit hook. All
+files share the time origin of the main process (``perf_counter`` is one
+clock across processes), and at exit the main process merges the worker
+files of its run into the main trace and the summary.
+"""
+
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+__all__ = [
+    "TRACE_ENV", "span", "traced", "enable", "disable", "is_enabled", "summary", "write_trace", "flush_worker",
+]
+
+TRACE_ENV = "SX_TRACE"
+ROOT_PID_ENV = "SX_TRACE_ROOT_PID"
+ORIGIN_ENV = "SX_TRACE_ORIGIN_NS"
+
+_enabled = False
+_path: Path | None = None
+_root_pid: int | None = None  # process that owns the main trace file, every other one is a worker
+_origin_ns: int | None = None  # perf_counter_ns of the main process at enable, t = 0 in every file
+_events: list[tuple[str, int, int, int, int]] = []  # (name, start ns, duration ns, pid, tid)
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        # list.append is atomic, spans from worker threads need no lock
+        _events.append((self.name, self.t0, time.perf_counter_ns() - self.t0, os.getpid(), threading.get_ident()))
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name: str):
+    """Context manager timing the enclosed block as *name* when tracing is enabled."""
+    return _Span(name) if _enabled else _NULL_SPAN
+
+
+def traced(name: str | None = None):
+    """Decorator recording each call of the function as a span."""
+
+    def decorator(func):
+        label = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(label):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def enable(path: str | Path | None = None) -> None:
+    """Start recording; with *path*, the trace is written there at exit."""
+    global _enabled, _path, _root_pid, _origin_ns
+    _enabled = True
+    if _root_pid is None:
+        _root_pid, _origin_ns = os.getpid(), time.perf_counter_ns()
+        # inherited by spawned workers
+        os.environ[ROOT_PID_ENV], os.environ[ORIGIN_ENV] = str(_root_pid), str(_origin_ns)
+    if path is not None and _path is None:
+        atexit.register(_dump)
+    _path = Path(path) if path is not None else _path
+
+
+def disable() -> None:
+    global _enabled
+    _enabled = False
+
+
+def summary() -> dict[str, dict[str, float]]:
+    """Aggregate the recorded spans per name: count, total, mean and max (seconds)."""
+    stats: dict[str, dict[str, float]] = {}
+    for name, _, duration, _, _ in list(_events):
+        entry = stats.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        entry["count"] += 1
+        entry["total"] += duration / 1e9
+        entry["max"] = max(entry["max"], duration / 1e9)
+    for entry in stats.values():
+        entry["mean"] = entry["total"] / entry["count"]
+    return dict(sorted(stats.items(), key=lambda item: -item[1]["total"]))
+
+
+def write_trace(path: str | Path) -> None:
+    """Write the recorded spans as Chrome trace-event JSON (complete "X" events, µs since the shared origin)."""
+    events = list(_events)
+    t_origin = _origin_ns if _origin_ns is not None else min((t0 for _, t0, _, _, _ in events), default=0)
+    trace = {
+        "traceEvents": [
+            {"name": name, "ph": "X", "ts": (t0 - t_origin) / 1e3, "dur": duration / 1e3, "pid": pid, "tid": tid}
+            for name, t0, duration, pid, tid in events
+        ],
+        "displayTimeUnit": "ms",
+        "otherData": {"root_pid": _root_pid, "origin_ns": t_origin},
+    }
+    Path(path).write_text(json.dumps(trace))
+
+
+def flush_worker() -> None:
+    """Write the spans of this worker process to ``<trace>.<pid>.json``.
+
+    No-op in the main process and while tracing is disabled. Safe to call
+    after every task, the file is rewritten with all spans of the worker.
+    """
+    if _enabled and _path is not None and os.getpid() != _root_pid and _events:
+        write_trace(_worker_path())
+
+
+def _worker_path() -> Path:
+    return _path.with_name(f"{_path.stem}.{os.getpid()}{_path.suffix}")
+
+
+def _merge_workers() -> None:
+    # Fold the worker files of this run (same root pid and origin) into the events, then remove them
+    run = {"root_pid": _root_pid, "origin_ns": _origin_ns}
+    for path in _path.parent.glob(f"{_path.stem}.*{_path.suffix}"):
+        if not path.name[len(_path.stem) + 1 : -len(_path.suffix) or None].isdigit():
+            continue
+        try:
+            trace = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if trace.get("otherData") != run:
+            continue
+        _events.extend(
+            (event["name"], _origin_ns + round(event["ts"] * 1e3), round(event["dur"] * 1e3), event["pid"], event["tid"])
+            for event in trace["traceEvents"]
+        )
+        path.unlink()
+
+
+def _dump() -> None:
+    if _path is None:
+        return
+    if os.getpid() != _root_pid:
+        if _events:
+            write_trace(_worker_path())
+        return
+    _merge_workers()
+    if not _events:
+        return
+    write_trace(_path)
+    print(f"{'span':<32} {'count':>7} {'total [s]':>10} {'mean [ms]':>10} {'max [ms]':>10}")
+    for name, entry in summary().items():
+        print(f"{name:<32} {entry['count']:>7} {entry['total']:>10.3f} "
+              f"{entry['mean'] * 1e3:>10.2f} {entry['max'] * 1e3:>10.2f}")
+    print(f"Trace written to {_path}")
+
+
+# Forked workers start with a copy of the parent's spans, only their own belong in their file
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_events.clear)
+
+if os.environ.get(TRACE_ENV):
+    # Spawned worker processes inherit these variables and re-import this module as workers
+    if ROOT_PID_ENV in os.environ:
+        _root_pid, _origin_ns = int(os.environ[ROOT_PID_ENV]), int(os.environ[ORIGIN_ENV])
+    enable(os.environ[TRACE_ENV])
@@ -0,0 +1,123 @@
+import numpy as np
+
+# Voxel indices are packed into one int64 key, 21 bits per axis (signed via offset)
+_BITS = 21
+_OFFSET = 1 << (_BITS - 1)
+_MASK = (1 << _BITS) - 1
+
+
+class SparseQGrid:
+    """Sparse (intensity, count) accumulator over cubic q-space voxels of size *dq*.
+
+    Only occupied voxels are stored, as sorted int64 keys packed from the
+    (i, j, k) voxel index relative to *origin*, next to the summed intensity
+    and the number of contributing pixels. Memory scales with the occupied
+    voxels instead of the bounding box of the data.
+    """
+
+    def __init__(self, dq: float, origin=(0.0, 0.0, 0.0)):
+        self.dq = float(dq) # unit (1/A)
+        self.origin = np.asarray(origin, dtype=np.float64) # unit (1/A)
+        self.keys = np.empty(0, dtype=np.int64)
+        self.intensity = np.empty(0, dtype=np.float64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.keys.size
+
+    def __repr__(self) -> str:  # pragma: no cover – purely cosmetic
+        return f"SparseQGrid(dq={self.dq:.1e}, voxels={len(self)})"
+
+    #Private Methods
+    def _index(self, qpoints) -> np.ndarray:
+        ijk = np.empty((3, np.size(qpoints[0])), dtype=np.int64)
+        for axis in range(3):
+            ijk[axis] = np.floor((np.ravel(qpoints[axis]) - self.origin[axis]) / self.dq)
+        return ijk
+
+    def _pack(self, ijk: np.ndarray) -> np.ndarray:
+        shifted = ijk + _OFFSET
+        if shifted.size and (shifted.min() < 0 or shifted.max() > _MASK):
+            raise ValueError("q-points outside the span of the sparse grid, choose a closer origin or a larger dq")
+        return (shifted[0] << (2 * _BITS)) | (shifted[1] << _BITS) | shifted[2]
+
+    def _merge(self, keys: np.ndarray, intensity: np.ndarray, counts: np.ndarray) -> None:
+        # *keys* are unique and sorted: existing voxels are updated in place, only new keys are inserted
+        pos = np.searchsorted(self.keys, keys)
+        found = pos < self.keys.size
+        found[found] = self.keys[pos[found]] == keys[found]
+        self.intensity[pos[found]] += intensity[found]
+        self.counts[pos[found]] += counts[found]
+
+        new = ~found
+        if new.any():
+            self.keys = np.insert(self.keys, pos[new], keys[new])
+            self.intensity = np.insert(self.intensity, pos[new], intensity[new])
+            self.counts = np.insert(self.counts, pos[new], counts[new])
+
+    #Public Methods
+    def add(self, qpoints, intensity) -> None:
+        """Accumulate pixels at *qpoints* (q1, q2, q3) with weights *intensity*."""
+        ijk = self._index(qpoints)
+        weights = np.ravel(intensity).astype(np.float64, copy=False)
+        if weights.size != ijk.shape[1]:
+            raise ValueError("`intensity` must have one value per q-point")
+        keys = self._pack(ijk)
+        # Reduce the batch on its own first, the merge then only sees unique sorted keys
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        self._merge(
+            uniq,
+            np.bincount(inverse, weights=weights, minlength=uniq.size),
+            np.bincount(inverse, minlength=uniq.size).astype(np.int64),
+        )
+
+    def merge(self, other: "SparseQGrid") -> None:
+        """Fold another accumulator with identical *dq* and *origin* into this one."""
+        if other.dq != self.dq or not np.array_equal(other.origin, self.origin):
+            raise ValueError("Sparse grids must share `dq` and `origin` to be merged")
+        self._merge(other.keys, other.intensity, other.counts)
+
+    def voxels(self) -> np.ndarray:
+        """Return the (3, n) integer voxel indices of the occupied voxels."""
+        shifted = np.stack((self.keys >> (2 * _BITS), (self.keys >> _BITS) & _MASK, self.keys & _MASK))
+        return shifted - _OFFSET
+
+    def centers(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Return the q-coordinates (q1, q2, q3) of the occupied voxel centres."""
+        q = (self.voxels() + 0.5) * self.dq + self.origin[:, None] # unit (1/A)
+        return q[0], q[1], q[2]
+
+    def mean(self) -> np.ndarray:
+        """Average intensity per occupied voxel (same semantics as ``qrebin``)."""
+        return self.intensity / self.counts
+
+    def qrange(self) -> tuple[tuple[float, float], ...]:
+        """Return the bounding box of the occupied voxels as ((min, max),) * 3."""
+        if not len(self):
+            raise ValueError("Sparse grid is empty")
+        ijk = self.voxels()
+        lo = ijk.min(axis=1) * self.dq + self.origin
+        hi = (ijk.max(axis=1) + 1) * self.dq + self.origin
+        return tuple((float(lo[axis]), float(hi[axis])) for axis in range(3))
+
+    def to_dense(self, qrange=None, average: bool = True):
+        """Export the voxels inside *qrange* as a dense sub-volume.
+
+        The region is snapped outwards to whole voxels. Returns the volume
+        (averaged intensity, or summed counts if *average* is False) and the
+        bin edges along each axis, like ``np.histogramdd``.
+        """
+        if qrange is None:
+            qrange = self.qrange()
+        lo = np.array([np.floor((qrange[axis][0] - self.origin[axis]) / self.dq) for axis in range(3)], dtype=np.int64)
+        hi = np.array([np.ceil((qrange[axis][1] - self.origin[axis]) / self.dq) for axis in range(3)], dtype=np.int64)
+        shape = tuple(int(n) for n in np.maximum(hi - lo, 0))
+
+        ijk = self.voxels()
+        inside = np.all((ijk >= lo[:, None]) & (ijk < hi[:, None]), axis=0)
+        local = tuple(ijk[:, inside] - lo[:, None])
+
+        volume = np.zeros(shape, dtype=np.float64)
+        volume[local] = self.mean()[inside] if average else self.counts[inside]
+        edges = tuple((np.arange(lo[axis], hi[axis] + 1) * self.dq + self.origin[axis]) for axis in range(3))
+        return volume, edges